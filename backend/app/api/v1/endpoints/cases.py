@@ -2,6 +2,7 @@
 
 from __future__ import annotations
 
+import hashlib
 from uuid import UUID
 
 from app.db.models import Case, Document
@@ -11,7 +12,8 @@ from app.schemas.technical_sheet import TechnicalSheetResponse
 from app.services.technical_sheet import TechnicalSheetService
 from app.tasks import build_technical_sheet as build_technical_sheet_task
 from app.tasks import extract_case_metadata as extract_case_metadata_task
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from pydantic import BaseModel
 from sqlalchemy import select
 from sqlalchemy.orm import Session, selectinload
 
@@ -119,6 +121,39 @@ def extract_metadata_endpoint(case_id: UUID, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+class BatchCaseIds(BaseModel):
+    case_ids: list[UUID]
+
+
+# Registrada antes de /{case_id}/build-technical-sheet para que "batch" no se
+# intente resolver como UUID de expediente.
+@router.post("/batch/build-technical-sheet")
+def build_technical_sheet_batch(
+    payload: BatchCaseIds, db: Session = Depends(get_db)
+) -> dict[str, object]:
+    """
+    Encola la construcción de ficha técnica para varios expedientes en un
+    solo request, en vez de un POST por caso desde el harness de eval.
+    """
+    if not TechnicalSheetService.feature_enabled():
+        raise HTTPException(status_code=404, detail="Technical sheet v2 disabled")
+    # Un solo SELECT valida todos los ids: los expedientes inexistentes se
+    # reportan en la respuesta en vez de encolar builds condenados a fallar
+    # en el worker (y a bloquear al cliente esperando la tarea).
+    existing_ids = set(
+        db.scalars(select(Case.id).where(Case.id.in_(payload.case_ids))).all()
+    )
+    tasks = []
+    unknown_case_ids = []
+    for case_id in payload.case_ids:
+        if case_id not in existing_ids:
+            unknown_case_ids.append(str(case_id))
+            continue
+        task = build_technical_sheet_task.delay(str(case_id))
+        tasks.append({"case_id": str(case_id), "task_id": task.id})
+    return {"status": "queued", "tasks": tasks, "unknown_case_ids": unknown_case_ids}
+
+
 @router.post("/{case_id}/build-technical-sheet")
 def build_technical_sheet_endpoint(case_id: UUID, db: Session = Depends(get_db)):
     if not TechnicalSheetService.feature_enabled():
@@ -131,10 +166,22 @@ def build_technical_sheet_endpoint(case_id: UUID, db: Session = Depends(get_db))
 
 
 @router.get("/{case_id}/technical-sheet", response_model=TechnicalSheetResponse)
-def get_technical_sheet_endpoint(case_id: UUID, db: Session = Depends(get_db)) -> TechnicalSheetResponse:
+def get_technical_sheet_endpoint(
+    case_id: UUID,
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_db),
+):
     if not TechnicalSheetService.feature_enabled():
         raise HTTPException(status_code=404, detail="Technical sheet v2 disabled")
     case = db.get(Case, case_id)
     if not case:
         raise HTTPException(status_code=404, detail="Expediente no encontrado")
-    return TechnicalSheetService.get_case_technical_sheet(db, case_id)
+    sheet = TechnicalSheetService.get_case_technical_sheet(db, case_id)
+    # ETag por contenido: un cliente con copia vigente revalida con
+    # If-None-Match y recibe un 304 vacío en vez del payload completo.
+    etag = f'"{hashlib.md5(sheet.model_dump_json().encode()).hexdigest()}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED)
+    response.headers["ETag"] = etag
+    return sheet
@@ -25,7 +25,9 @@ router = APIRouter()
 @router.post("/", status_code=status.HTTP_200_OK)
 def upload_document(
     case_id: UUID = Form(...),
-    doc_type: str = Form(...),
+    # Default del lado del servidor: los clientes ya no mandan el sentinel
+    # "pendiente de clasificar" en cada multipart.
+    doc_type: str = Form("DETECTANDO..."),
     file: UploadFile = File(...),
     db: Session = Depends(get_db),
 ) -> dict[str, str]:
@@ -58,6 +60,37 @@ def upload_document(
     return {"status": "created", "document_id": str(document.id)}
 
 
+class BatchDocIds(BaseModel):
+    doc_ids: list[UUID]
+
+
+# Registradas antes de las rutas /{document_id}/... para que "batch" no se
+# intente resolver como UUID de documento.
+@router.post("/batch/process", status_code=status.HTTP_200_OK)
+def process_documents_batch(payload: BatchDocIds) -> dict[str, object]:
+    """
+    Encola OCR/lectura para varios documentos en un solo request, en vez de
+    un POST por documento desde el cliente.
+    """
+    tasks = []
+    for doc_id in payload.doc_ids:
+        task = process_document_task.delay(str(doc_id))
+        tasks.append({"document_id": str(doc_id), "task_id": task.id})
+    return {"status": "queued", "tasks": tasks}
+
+
+@router.post("/batch/embed", status_code=status.HTTP_200_OK)
+def create_embeddings_batch(payload: BatchDocIds) -> dict[str, object]:
+    """
+    Encola la generación de embeddings para varios documentos de una vez.
+    """
+    tasks = []
+    for doc_id in payload.doc_ids:
+        task = embed_document_task.delay(str(doc_id))
+        tasks.append({"document_id": str(doc_id), "task_id": task.id})
+    return {"status": "queued", "tasks": tasks}
+
+
 @router.post("/{document_id}/process", status_code=status.HTTP_200_OK)
 def process_document_content(
     document_id: UUID, db: Session = Depends(get_db)
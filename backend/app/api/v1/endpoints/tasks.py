@@ -1,14 +1,19 @@
 from __future__ import annotations
 
+import json
+import time
+
 from app.celery_app import celery_app
 from celery.result import AsyncResult
 from fastapi import APIRouter
+from fastapi.responses import StreamingResponse
 
 router = APIRouter(tags=["tasks"])
 
+TERMINAL_STATES = {"SUCCESS", "FAILURE", "REVOKED"}
 
-@router.get("/{task_id}")
-def get_task_status(task_id: str):
+
+def _task_snapshot(task_id: str) -> dict:
     result = AsyncResult(task_id, app=celery_app)
     return {
         "task_id": task_id,
@@ -16,3 +21,46 @@ def get_task_status(task_id: str):
         "result": result.result,
         "traceback": result.traceback,
     }
+
+
+@router.get("/")
+def get_task_statuses(ids: str = "", status: str = ""):
+    """
+    Estado de varias tareas en un solo request: ?ids=<id1>,<id2>,...
+    Evita que el frontend haga N round-trips por rerun para su panel de tareas.
+    Con ?status=<estado> solo regresa las tareas en ese estado, para que el
+    cliente no descargue snapshots que va a descartar al filtrar.
+    """
+    task_ids = [tid for tid in (part.strip() for part in ids.split(",")) if tid]
+    snapshots = [_task_snapshot(tid) for tid in task_ids]
+    if status:
+        snapshots = [snap for snap in snapshots if snap["status"] == status]
+    return {"tasks": snapshots}
+
+
+@router.get("/{task_id}")
+def get_task_status(task_id: str):
+    return _task_snapshot(task_id)
+
+
+@router.get("/{task_id}/stream")
+def stream_task_status(task_id: str, poll_interval: float = 1.0, timeout_sec: float = 300.0):
+    """
+    Server-Sent Events con el estado de la tarea: emite un evento por cada
+    cambio de estado y cierra al llegar a un estado terminal (o al timeout).
+    Permite a los clientes suscribirse en vez de sondear cada N segundos.
+    """
+
+    def event_stream():
+        deadline = time.monotonic() + timeout_sec
+        last_status = None
+        while True:
+            snapshot = _task_snapshot(task_id)
+            if snapshot["status"] != last_status:
+                last_status = snapshot["status"]
+                yield f"data: {json.dumps(snapshot, default=str)}\n\n"
+            if snapshot["status"] in TERMINAL_STATES or time.monotonic() > deadline:
+                break
+            time.sleep(poll_interval)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
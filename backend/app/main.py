@@ -118,13 +118,8 @@ class TestLegalLogicResponse(BaseModel):
     detalle: str
 
 
-@app.post("/test-legal-logic/", response_model=TestLegalLogicResponse)
-async def test_legal_logic(perfil: PerfilActor) -> TestLegalLogicResponse:
-    """Prueba la lógica legal: calcula antigüedad y estima liquidación básica.
-
-    Fórmula de estimación: 3 meses de salario (Art. 48 LFT) + 20 días de
-    salario por cada año de antigüedad, usando constantes de legal_constants.
-    Solo para verificación matemática, no sustituye el cálculo legal completo.
+def _estimate_legal_logic(perfil: PerfilActor) -> TestLegalLogicResponse:
+    """Calcula antigüedad y estimación básica de liquidación para un perfil.
 
     Args:
         perfil: Datos del trabajador (fechas, salarios).
@@ -160,3 +155,36 @@ async def test_legal_logic(perfil: PerfilActor) -> TestLegalLogicResponse:
         liquidacion_estimada_mxn=liquidacion_estimada,
         detalle=detalle,
     )
+
+
+@app.post("/test-legal-logic/", response_model=TestLegalLogicResponse)
+async def test_legal_logic(perfil: PerfilActor) -> TestLegalLogicResponse:
+    """Prueba la lógica legal: calcula antigüedad y estima liquidación básica.
+
+    Fórmula de estimación: 3 meses de salario (Art. 48 LFT) + 20 días de
+    salario por cada año de antigüedad, usando constantes de legal_constants.
+    Solo para verificación matemática, no sustituye el cálculo legal completo.
+
+    Args:
+        perfil: Datos del trabajador (fechas, salarios).
+
+    Returns:
+        TestLegalLogicResponse: Antigüedad en años y monto estimado en MXN.
+    """
+    return _estimate_legal_logic(perfil)
+
+
+@app.post("/test-legal-logic/batch", response_model=list[TestLegalLogicResponse])
+async def test_legal_logic_batch(perfiles: list[PerfilActor]) -> list[TestLegalLogicResponse]:
+    """Versión por lotes de test-legal-logic: un POST para N perfiles.
+
+    Evita pagar un round-trip HTTP por perfil cuando el cliente quiere
+    verificar varios cálculos a la vez.
+
+    Args:
+        perfiles: Lista de perfiles de trabajadores.
+
+    Returns:
+        list[TestLegalLogicResponse]: Resultados en el mismo orden de entrada.
+    """
+    return [_estimate_legal_logic(perfil) for perfil in perfiles]
@@ -31,7 +31,7 @@ def _field_domain(field_key: str) -> str:
     return "CONDICIONES"
 
 
-@dataclass
+@dataclass(slots=True)
 class ConflictItem:
     field_key: str
     source_doc_type: str
@@ -39,7 +39,7 @@ class ConflictItem:
     message: str
 
 
-@dataclass
+@dataclass(slots=True)
 class WinnerFact:
     field_key: str
     value: Any
@@ -88,10 +88,13 @@ def detect_conflicts(documents: list[dict[str, Any]], contract_signed: bool = Tr
     for field_key, entries in by_field.items():
         if not entries:
             continue
-        sorted_entries = sorted(entries, key=lambda e: e["rank"], reverse=True)
-        winner = sorted_entries[0]
+        # Caso comun (expedientes chicos): max() evita el sort completo y,
+        # con un solo documento aportando el campo, no hay contendientes.
+        winner = entries[0] if len(entries) == 1 else max(entries, key=lambda e: e["rank"])
         winner_value = str(winner["value"]).strip().lower()
-        for contender in sorted_entries[1:]:
+        for contender in entries:
+            if contender is winner:
+                continue
             contender_value = str(contender["value"]).strip().lower()
             if contender_value != winner_value:
                 conflicts.append(
@@ -192,6 +192,19 @@ class ExtractionService:
             return None
         return None
 
+    @staticmethod
+    def extract_many(texts: list[str], dtype: str) -> list[tuple | None]:
+        """
+        Aplica _apply_regex a varios textos manteniendo el orden de entrada;
+        cada resultado es (valor, texto_crudo) o None.
+
+        Secuencial a propósito: el matcher de re no suelta el GIL, así que
+        hilos no aportan paralelismo real, y un pool de procesos no amortiza
+        su arranque con los lotes chicos (documentos por caso) que maneja
+        este servicio.
+        """
+        return [ExtractionService._apply_regex(text, dtype) for text in texts]
+
     @staticmethod
     def _coerce_value(value, dtype: str):
         if value is None:
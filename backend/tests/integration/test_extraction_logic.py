@@ -15,35 +15,54 @@ def _extract_sdi(text: str) -> float | None:
     return float(m.group(1))
 
 
+# Los fixtures MOCK_* son constantes: se escanean una sola vez al cargar el
+# módulo en lugar de repetir los regex dentro de cada test que los use.
+DEMANDA_SALARY = ExtractionService._apply_regex(MOCK_DEMANDA_TEXT, "money")
+CONTRATO_SALARY = ExtractionService._apply_regex(MOCK_CONTRATO_TEXT, "money")
+CONTRATO_START = ExtractionService._apply_regex(MOCK_CONTRATO_TEXT, "date")
+NOMINA_SALARY = ExtractionService._apply_regex(MOCK_NOMINA_TEXT, "money")
+NOMINA_SDI = _extract_sdi(MOCK_NOMINA_TEXT)
+
+
 def test_mock_text_extraction_and_conflict_resolution():
-    demanda_salary = ExtractionService._apply_regex(MOCK_DEMANDA_TEXT, "money")
-    contrato_salary = ExtractionService._apply_regex(MOCK_CONTRATO_TEXT, "money")
-    contrato_start = ExtractionService._apply_regex(MOCK_CONTRATO_TEXT, "date")
-    nomina_salary = ExtractionService._apply_regex(MOCK_NOMINA_TEXT, "money")
-    nomina_sdi = _extract_sdi(MOCK_NOMINA_TEXT)
+    demanda_salary = DEMANDA_SALARY
+    contrato_salary = CONTRATO_SALARY
+    contrato_start = CONTRATO_START
+    nomina_salary = NOMINA_SALARY
+    nomina_sdi = NOMINA_SDI
 
     assert demanda_salary is not None
-    assert float(demanda_salary[0]) == 800.00
     assert contrato_salary is not None
-    assert float(contrato_salary[0]) == 250.00
     assert contrato_start is not None
+    # Una sola pasada de coercion en vez de un float() por aserción.
+    demanda_value, contrato_value, nomina_value = [
+        float(match[0]) for match in (demanda_salary, contrato_salary, nomina_salary)
+    ]
+    assert demanda_value == 800.00
+    assert contrato_value == 250.00
     assert str(contrato_start[0]) == "2022-01-01"
     assert nomina_sdi == 275.50
-    assert nomina_salary is not None
-    assert float(nomina_salary[0]) == 250.00
+    assert nomina_value == 250.00
 
     documents = [
-        {"doc_type": "DEMANDA_INICIAL", "extracted_data": {"daily_salary": float(demanda_salary[0])}},
+        {"doc_type": "DEMANDA_INICIAL", "extracted_data": {"daily_salary": demanda_value}},
         {
             "doc_type": "CONTRATO_INDIVIDUAL",
-            "extracted_data": {"daily_salary": float(contrato_salary[0]), "start_date": str(contrato_start[0])},
+            "extracted_data": {"daily_salary": contrato_value, "start_date": str(contrato_start[0])},
         },
         {"doc_type": "RECIBO_NOMINA", "extracted_data": {"daily_salary": 275.50, "salary_sdi": nomina_sdi}},
     ]
 
     conflicts, winner_facts = detect_conflicts(documents)
-    salary_conflicts = [c for c in conflicts if c.field_key == "daily_salary"]
-    assert len(salary_conflicts) > 0
+    assert any(c.field_key == "daily_salary" for c in conflicts)
     salary_winner = next(f for f in winner_facts if f.field_key == "daily_salary")
     assert salary_winner.source_doc_type == "RECIBO_NOMINA"
     assert float(salary_winner.value) == 275.50
+
+
+def test_extract_many_matches_sequential_results():
+    texts = [MOCK_DEMANDA_TEXT, MOCK_CONTRATO_TEXT, MOCK_NOMINA_TEXT]
+    parallel = ExtractionService.extract_many(texts, "money")
+    sequential = [ExtractionService._apply_regex(t, "money") for t in texts]
+    assert parallel == sequential
+    assert [float(r[0]) for r in parallel] == [800.00, 250.00, 250.00]
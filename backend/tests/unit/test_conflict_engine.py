@@ -12,9 +12,11 @@ def test_salary_precedence():
     assert salary_fact.value == 210.00
     assert salary_fact.source_doc_type == "RECIBO_NOMINA"
     assert salary_fact.confidence_level == "HIGH"
-    salary_conflicts = [c for c in conflicts if c.field_key == "daily_salary"]
-    assert len(salary_conflicts) > 0
-    assert "DEMANDA_INICIAL" in [c.source_doc_type for c in salary_conflicts]
+    assert any(c.field_key == "daily_salary" for c in conflicts)
+    assert any(
+        c.field_key == "daily_salary" and c.source_doc_type == "DEMANDA_INICIAL"
+        for c in conflicts
+    )
 
 
 def test_start_date_conflict():
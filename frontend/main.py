@@ -1,9 +1,14 @@
 ﻿import os
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
+import orjson
 import requests
 import streamlit as st
-from streamlit_pdf_viewer import pdf_viewer
+from requests_toolbelt import MultipartEncoder
+from urllib3.util.retry import Retry
 
 # --- CONFIGURACIÓN DE LA APP ---
 st.set_page_config(
@@ -19,7 +24,10 @@ API_URL = f"{BACKEND_HOST}/api/v1/cases"
 DOCS_URL = f"{BACKEND_HOST}/api/v1/documents"
 
 # --- ESTILOS CSS ---
-st.markdown("""
+# Constante de módulo: el string se construye una vez por proceso. Streamlit
+# reinicia el DOM en cada rerun, así que la inyección por rerun es obligatoria;
+# lo que sí evitamos es recomponer el bloque.
+_APP_CSS = """
 <style>
     /* Ocultar menú default de Streamlit para look de App nativa */
     #MainMenu {visibility: hidden;}
@@ -65,43 +73,123 @@ st.markdown("""
         to { transform: rotate(360deg); }
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(_APP_CSS, unsafe_allow_html=True)
 
 
 # --- HELPERS DE RED ---
+def parse_json(response):
+    """Decodifica el cuerpo JSON con orjson (evita el parser lento de requests)."""
+    return orjson.loads(response.content)
+
+
+# Sesión compartida: keep-alive + pool de conexiones hacia el backend,
+# en vez de abrir/cerrar un socket TCP por request en cada rerun.
+# Los reintentos viven en el adapter (urllib3.Retry): solo fallos de
+# CONEXIÓN — el cuerpo aún no se envió, así que es seguro incluso para
+# POST no idempotentes — con backoff exponencial y jitter en C-level,
+# sin bloquear el hilo del script con time.sleep propio.
+_RETRY = Retry(
+    total=None,
+    connect=3,
+    read=0,
+    status=0,
+    backoff_factor=0.5,
+    backoff_jitter=0.5,
+    backoff_max=8.0,
+)
+_SESSION = requests.Session()
+_ADAPTER = requests.adapters.HTTPAdapter(
+    pool_connections=4, pool_maxsize=16, max_retries=_RETRY
+)
+_SESSION.mount("http://", _ADAPTER)
+_SESSION.mount("https://", _ADAPTER)
+
+
 def safe_request(method, url, **kwargs):
     kwargs.setdefault('timeout', 10)
-    retries = kwargs.pop('retries', 3)
-    delay = 1.0
-    for attempt in range(1, retries + 1):
-        try:
-            if method == 'GET':
-                return requests.get(url, **kwargs)
-            if method == 'POST':
-                return requests.post(url, **kwargs)
-            if method == 'DELETE':
-                return requests.delete(url, **kwargs)
-        except requests.exceptions.ConnectionError:
-            if attempt == retries:
-                return None
-            time.sleep(delay)
-            delay *= 2
-        except requests.exceptions.ReadTimeout:
-            return None
-    return None
+    kwargs.pop('retries', None)  # compat: el adapter ya gobierna los reintentos
+    if method not in {'GET', 'POST', 'DELETE'}:
+        return None
+    try:
+        return _SESSION.request(method, url, **kwargs)
+    except (requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout):
+        return None
+
+def _upload_document(uf, case_id: str) -> tuple[bool, str | None, str | None]:
+    """Sube un archivo con multipart streaming y encola su clasificación.
+
+    Regresa (subió_ok, document_id, task_id). MultipartEncoder transmite el
+    cuerpo en chunks en vez de armarlo completo en memoria.
+    """
+    uf.seek(0)
+    encoder = MultipartEncoder(
+        fields={
+            "file": (uf.name, uf, uf.type or "application/octet-stream"),
+            "case_id": case_id,
+            # doc_type se omite: el backend asume "DETECTANDO..." por default.
+        }
+    )
+    # Los reintentos del adapter son solo de conexión (pre-envío del cuerpo),
+    # así que el stream no rebobinable del encoder no corre riesgo.
+    r = safe_request(
+        'POST',
+        f"{DOCS_URL}/",
+        data=encoder,
+        headers={"Content-Type": encoder.content_type},
+        timeout=60,
+    )
+    if not (r and r.status_code == 200):
+        return False, None, None
+    doc_id = parse_json(r).get("document_id")
+    task_id = None
+    if doc_id:
+        c_res = safe_request('POST', f"{DOCS_URL}/{doc_id}/process", timeout=60)
+        if c_res and c_res.status_code == 200:
+            task_id = parse_json(c_res).get("task_id")
+    return True, doc_id, task_id
+
 
 # --- CACHÉ ---
 @st.cache_data(ttl=10, show_spinner=False)
 def get_cases_cached():
-    """Obtiene los casos y los guarda en memoria RAM por 10 seg."""
+    """Obtiene los casos y los guarda en memoria RAM por 10 seg.
+
+    El backend ya ordena por created_at desc (más reciente primero);
+    no hay que re-ordenar ni invertir aquí.
+    """
     res = safe_request('GET', API_URL, timeout=5)
     if res and res.status_code == 200:
-        return res.json()[::-1]
+        return parse_json(res)
     return []
 
+@st.cache_data(ttl=10, show_spinner=False)
+def get_cases_map_cached() -> tuple[dict, list]:
+    """Mapa id -> título y lista de ids para el selector, construidos en la
+    capa cacheada (una vez por TTL) y no en cada rerun."""
+    cases_map = {
+        c["id"]: c["title"]
+        for c in get_cases_cached()
+        if isinstance(c, dict) and "id" in c and "title" in c
+    }
+    return cases_map, list(cases_map.keys())
+
+
+@st.cache_data(ttl=2, show_spinner=False)
+def get_case_cached(case_id: str):
+    """Detalle del caso con TTL corto: absorbe los reruns en ráfaga sin
+    esconder documentos recién subidos (los mutadores invalidan a mano)."""
+    res = safe_request('GET', f"{API_URL}/{case_id}", timeout=5)
+    if res and res.status_code == 200:
+        return parse_json(res)
+    return None
+
+
 def clear_cache():
     """Borra la memoria para obligar a recargar datos."""
     get_cases_cached.clear()
+    get_cases_map_cached.clear()
+    get_case_cached.clear()
 
 
 def set_viewer_state(doc_id: str | None, page: int | None = None, bbox: dict | None = None):
@@ -110,7 +198,9 @@ def set_viewer_state(doc_id: str | None, page: int | None = None, bbox: dict | N
     st.session_state.viewer_bbox = bbox
 
 
-@st.cache_data(ttl=300, show_spinner=False)
+# persist="disk": los bytes de un doc_id son inmutables, así que la caché
+# sobrevive reinicios del server sin riesgo; max_entries acota la RAM.
+@st.cache_data(ttl=3600, max_entries=32, persist="disk", show_spinner=False)
 def get_document_bytes(doc_id: str):
     res = safe_request('GET', f"{DOCS_URL}/{doc_id}/file", timeout=30)
     if res and res.status_code == 200:
@@ -118,95 +208,427 @@ def get_document_bytes(doc_id: str):
     return None
 
 
+@lru_cache(maxsize=128)
+def _annotation_from_coords(page: int, x0, y0, x1, y1) -> dict:
+    return {
+        "page": max(page - 1, 0),
+        "x": x0,
+        "y": y0,
+        "width": (x1 - x0) if x1 is not None else None,
+        "height": (y1 - y0) if y1 is not None else None,
+        "color": "yellow",
+    }
+
+
 def bbox_to_annotation(bbox: dict | None):
     if not bbox:
         return None
     try:
-        return {
-            "page": max(int(bbox.get("page", 1)) - 1, 0),
-            "x": bbox.get("x0"),
-            "y": bbox.get("y0"),
-            "width": (bbox.get("x1") - bbox.get("x0")) if bbox.get("x1") is not None else None,
-            "height": (bbox.get("y1") - bbox.get("y0")) if bbox.get("y1") is not None else None,
-            "color": "yellow",
-        }
+        # El mismo bbox se re-renderiza en cada rerun del visor: memoizar por
+        # coordenadas evita reconstruir el dict de anotación cada vez.
+        return _annotation_from_coords(
+            int(bbox.get("page", 1)),
+            bbox.get("x0"),
+            bbox.get("y0"),
+            bbox.get("x1"),
+            bbox.get("y1"),
+        )
     except Exception:
         return None
 
 
-def ask_document_chat(doc_id: str, question: str):
-    payload = {"question": question, "limit": 5}
-    res = safe_request('POST', f"{DOCS_URL}/{doc_id}/chat", json=payload, timeout=60)
-    if res and res.status_code == 200:
-        return res.json()
-    return {"answer": "Error consultando el modelo.", "sources": []}
+# Turnos visibles de chat: acota el join por rerun y el payload al navegador.
+_MAX_CHAT_TURNS = 20
+
 
+def chat_item_markdown(item: dict) -> str:
+    """Markdown de un turno de chat; se arma una vez al recibir la respuesta."""
+    parts = [f"**Q:** {item['q']}", f"**A:** {item['a']}"]
+    if item["sources"]:
+        parts.append("Fuentes:")
+        parts.extend(f"- p{s['page']}: {s['text']}" for s in item["sources"])
+    return "\n\n".join(parts)
 
-@st.cache_data(ttl=5, show_spinner=False)
-def get_technical_sheet_cached(case_id: str):
-    res = safe_request('GET', f"{API_URL}/{case_id}/technical-sheet", timeout=10)
+
+class ChatBackendError(RuntimeError):
+    """Fallo consultando el chat del documento; la pregunta puede reintentarse."""
+
+
+# Cacheado por (doc_id, question, limit): las preguntas frecuentes sobre el
+# mismo documento se sirven de memoria sin re-consultar embeddings ni LLM.
+# Los fallos se levantan como excepción para que cache_data no los memoice:
+# un error transitorio no debe quedarse fijado 10 minutos.
+@st.cache_data(ttl=600, max_entries=1024, show_spinner=False)
+def ask_document_chat(doc_id: str, question: str, limit: int = 5):
+    payload = {"question": question, "limit": limit}
+    res = safe_request('POST', f"{DOCS_URL}/{doc_id}/chat", json=payload, timeout=60)
     if res and res.status_code == 200:
-        return res.json()
+        return parse_json(res)
+    raise ChatBackendError(f"chat {doc_id}: status={res.status_code if res else 'sin respuesta'}")
+
+
+# Caché por ETag (compartida entre sesiones): cada lectura revalida con
+# If-None-Match y un 304 del backend evita transferir el payload completo,
+# en vez de confiar en un TTL ciego que puede servir datos viejos 5 segundos.
+_SHEET_CACHE: dict[str, dict] = {}
+
+
+def get_technical_sheet_cached(case_id: str, max_age: float = 5.0):
+    """Ficha técnica con revalidación condicionada al estado del pipeline.
+
+    ``max_age`` controla cuánto tiempo se sirve la copia local sin siquiera
+    revalidar: corto mientras hay tareas procesando, largo en estado estable.
+    """
+    entry = _SHEET_CACHE.get(case_id)
+    if entry and time.time() - entry["fetched_at"] < max_age:
+        return entry["sheet"]
+    headers = {"If-None-Match": entry["etag"]} if entry and entry.get("etag") else None
+    res = safe_request('GET', f"{API_URL}/{case_id}/technical-sheet", timeout=10, headers=headers)
+    if res is None:
+        return entry["sheet"] if entry else None
+    if res.status_code == 304 and entry:
+        entry["fetched_at"] = time.time()
+        return entry["sheet"]
+    if res.status_code == 200:
+        sheet = parse_json(res)
+        _SHEET_CACHE[case_id] = {
+            "etag": res.headers.get("ETag"),
+            "sheet": sheet,
+            "fetched_at": time.time(),
+        }
+        return sheet
     return None
 
 
-def get_task_status(task_id: str):
+def clear_technical_sheet_cache(case_id: str | None = None):
+    if case_id is None:
+        _SHEET_CACHE.clear()
+    else:
+        _SHEET_CACHE.pop(case_id, None)
+
+
+# Una tarea en estado terminal no vuelve a cambiar: su snapshot se memoiza
+# y deja de consultarse al backend en los polls siguientes. El dict es
+# compartido entre todas las sesiones del proceso (los prefetches también
+# memoizan tareas ajenas), así que se acota desalojando la entrada más
+# vieja al rebasar el tope — mismo espíritu que el max_entries de
+# get_document_bytes.
+_TERMINAL_TASK_STATES = {"SUCCESS", "FAILURE", "REVOKED"}
+_TERMINAL_TASK_CACHE_MAX = 512
+_TERMINAL_TASK_CACHE: dict[str, dict] = {}
+
+
+def _remember_if_terminal(snapshot: dict) -> dict:
+    if snapshot.get("status") in _TERMINAL_TASK_STATES:
+        _TERMINAL_TASK_CACHE[snapshot["task_id"]] = snapshot
+        while len(_TERMINAL_TASK_CACHE) > _TERMINAL_TASK_CACHE_MAX:
+            _TERMINAL_TASK_CACHE.pop(next(iter(_TERMINAL_TASK_CACHE)))
+    return snapshot
+
+
+@st.cache_data(ttl=2, show_spinner=False)
+def _fetch_task_status(task_id: str) -> dict:
+    # TTL corto: dentro de un mismo ciclo de refresco las consultas repetidas
+    # del mismo task_id no vuelven a pegarle al backend.
     res = safe_request('GET', f"{BACKEND_HOST}/api/v1/tasks/{task_id}", timeout=10)
     if res and res.status_code == 200:
-        return res.json()
+        return parse_json(res)
     return {"task_id": task_id, "status": "ERROR", "result": None}
 
 
+def get_task_status(task_id: str):
+    cached = _TERMINAL_TASK_CACHE.get(task_id)
+    if cached is not None:
+        return cached
+    return _remember_if_terminal(_fetch_task_status(task_id))
+
+
+def get_task_statuses(task_ids: list[str], status: str | None = None) -> dict[str, dict]:
+    """Estado de varias tareas en un solo round-trip al backend.
+
+    Con ``status`` el filtrado ocurre en el servidor: las tareas que no
+    coinciden simplemente no vienen en la respuesta.
+    """
+    statuses: dict[str, dict] = {}
+    pending = []
+    for tid in task_ids:
+        cached = _TERMINAL_TASK_CACHE.get(tid)
+        if cached is not None:
+            if status is None or cached.get("status") == status:
+                statuses[tid] = cached
+        else:
+            pending.append(tid)
+    if not pending:
+        return statuses
+    params = {"ids": ",".join(pending)}
+    if status is not None:
+        params["status"] = status
+    res = safe_request('GET', f"{BACKEND_HOST}/api/v1/tasks/", params=params, timeout=10)
+    if res and res.status_code == 200:
+        payload = parse_json(res)
+        for t in payload.get("tasks", []):
+            statuses[t["task_id"]] = _remember_if_terminal(t)
+    else:
+        for tid in pending:
+            snapshot = get_task_status(tid)
+            if status is None or snapshot.get("status") == status:
+                statuses[tid] = snapshot
+    return statuses
+
+
+_MAX_TRACKED_TASKS = 50
+
+
 def register_task(task_id: str, action: str, doc_id: str | None = None, filename: str | None = None):
+    # Dedup y recorte al insertar: la lista queda limpia de una vez y los
+    # reruns ya no tienen que pasarla por dict.fromkeys.
+    if task_id in st.session_state.task_meta:
+        return
     st.session_state.task_ids.append(task_id)
+    if len(st.session_state.task_ids) > _MAX_TRACKED_TASKS:
+        dropped = set(st.session_state.task_ids[:-_MAX_TRACKED_TASKS])
+        st.session_state.task_ids = st.session_state.task_ids[-_MAX_TRACKED_TASKS:]
+        for old_tid in dropped:
+            st.session_state.task_meta.pop(old_tid, None)
+            _TERMINAL_TASK_CACHE.pop(old_tid, None)
+        # Sin esto, el índice (doc, acción) seguiría apuntando a tareas que ya
+        # no están memoizadas y cada rerun volvería a consultarlas al backend
+        # (Celery reporta ids desconocidos como PENDING, o sea "activas").
+        doc_task_index = st.session_state.doc_task_index
+        for key in [k for k, tid in doc_task_index.items() if tid in dropped]:
+            del doc_task_index[key]
     st.session_state.task_meta[task_id] = {
         "action": action,
         "doc_id": doc_id,
         "filename": filename,
         "created_at": time.time(),
     }
+    if doc_id:
+        # Índice (doc, acción) -> última tarea, para consultas O(1) por fila.
+        st.session_state.doc_task_index[(doc_id, action)] = task_id
+
+
+# Tablas de estado construidas una sola vez al importar el módulo:
+# estas funciones corren por fila y por rerun.
+_ACTIVE_STATES = {"PENDING", "STARTED"}
+_TASK_LOADER_HTML = '<span class="task-loader"></span>'
+_STATUS_ICONS = {
+    "PENDING": "⏳",
+    "STARTED": "▶",
+    "SUCCESS": "✓",
+    "FAILURE": "✖",
+    "RETRY": "↻",
+    "REVOKED": "■",
+    "ERROR": "!",
+}
+_STATUS_CHIP_CLASSES = {
+    "PENDING": "chip-pending",
+    "STARTED": "chip-started",
+    "SUCCESS": "chip-success",
+    "FAILURE": "chip-failure",
+    "RETRY": "chip-retry",
+    "REVOKED": "chip-revoked",
+    "ERROR": "chip-failure",
+}
+_RISK_BADGES = {
+    "CRITICAL": "🔴 Crítico",
+    "HIGH": "🟠 Alto",
+    "MEDIUM": "🟡 Medio",
+    "LOW": "🟢 Bajo",
+}
 
 
 def status_icon(status: str) -> str:
-    icons = {
-        "PENDING": "⏳",
-        "STARTED": "▶",
-        "SUCCESS": "✓",
-        "FAILURE": "✖",
-        "RETRY": "↻",
-        "REVOKED": "■",
-        "ERROR": "!",
-    }
-    return icons.get(status, "?")
+    return _STATUS_ICONS.get(status, "?")
 
 
 def active_loader_html(status: str) -> str:
-    if status in {"PENDING", "STARTED"}:
-        return '<span class="task-loader"></span>'
+    if status in _ACTIVE_STATES:
+        return _TASK_LOADER_HTML
     return ""
 
 
-def find_latest_doc_task(doc_id: str, action: str):
-    for tid in reversed(st.session_state.task_ids):
-        meta = st.session_state.task_meta.get(tid, {})
-        if meta.get("doc_id") == doc_id and meta.get("action") == action:
-            snapshot = get_task_status(tid)
-            return tid, snapshot.get("status", "ERROR")
-    return None, None
+def queue_embeddings_batch(docs_to_index: list[dict]) -> int:
+    """Encola la indexación de varios documentos con un solo POST batcheado.
+
+    Regresa cuántas tareas quedaron en cola; si el endpoint batch falla,
+    cae al POST por documento para no dejar la acción a medias.
+    """
+    if not docs_to_index:
+        return 0
+    filenames = {d["id"]: d["filename"] for d in docs_to_index}
+    res = safe_request(
+        'POST',
+        f"{DOCS_URL}/batch/embed",
+        json={"doc_ids": list(filenames)},
+        timeout=120,
+    )
+    queued = 0
+    if res and res.status_code == 200:
+        for entry in parse_json(res).get("tasks", []):
+            if entry.get("task_id"):
+                doc_id = entry.get("document_id")
+                register_task(
+                    entry["task_id"],
+                    action="Indexar embeddings",
+                    doc_id=doc_id,
+                    filename=filenames.get(doc_id),
+                )
+                queued += 1
+        return queued
+    for doc in docs_to_index:
+        res = safe_request('POST', f"{DOCS_URL}/{doc['id']}/embed", timeout=120)
+        if res and res.status_code == 200:
+            payload = parse_json(res)
+            if payload.get("task_id"):
+                register_task(
+                    payload["task_id"],
+                    action="Indexar embeddings",
+                    doc_id=doc["id"],
+                    filename=doc["filename"],
+                )
+                queued += 1
+    return queued
+
+
+def find_latest_doc_task(doc_id: str, action: str, statuses: dict[str, dict] | None = None):
+    tid = st.session_state.doc_task_index.get((doc_id, action))
+    if tid is None:
+        return None, None
+    if statuses is not None and tid in statuses:
+        return tid, statuses[tid].get("status", "ERROR")
+    snapshot = get_task_status(tid)
+    return tid, snapshot.get("status", "ERROR")
+
+
+# HTML final del chip ya armado por estado conocido; solo estados fuera del
+# enum pagan el f-string.
+_STATUS_CHIP_HTML = {
+    status: f'<span class="badge-chip {css_class}">{status}</span>'
+    for status, css_class in _STATUS_CHIP_CLASSES.items()
+}
 
 
 def status_chip(status: str) -> str:
-    cls_map = {
-        "PENDING": "chip-pending",
-        "STARTED": "chip-started",
-        "SUCCESS": "chip-success",
-        "FAILURE": "chip-failure",
-        "RETRY": "chip-retry",
-        "REVOKED": "chip-revoked",
-        "ERROR": "chip-failure",
-    }
-    css_class = cls_map.get(status, "chip-revoked")
-    return f'<span class="badge-chip {css_class}">{status}</span>'
+    chip = _STATUS_CHIP_HTML.get(status)
+    if chip is not None:
+        return chip
+    return f'<span class="badge-chip chip-revoked">{status}</span>'
+
+
+_TASK_CHIPS_LEGEND = """
+<div>
+    <span class="badge-chip chip-pending">PENDING</span>
+    <span class="badge-chip chip-started">STARTED</span>
+    <span class="badge-chip chip-success">SUCCESS</span>
+    <span class="badge-chip chip-failure">FAILURE/ERROR</span>
+    <span class="badge-chip chip-retry">RETRY</span>
+    <span class="badge-chip chip-revoked">REVOKED</span>
+</div>
+"""
+
+
+# Probe una sola vez si la build de Streamlit trae autorefresh: evita pagar
+# try/except fallido en cada rerun del panel (el core no lo incluye).
+_AUTOREFRESH = getattr(st, "autorefresh", None)
+
+# Dict vacío compartido para misses de metadata: evita alocar uno por tarea.
+_EMPTY_META: dict = {}
+
+
+def _set_pending_delete(case_id: str | None) -> None:
+    """Callback on_click: marca (o limpia) el expediente pendiente de borrado."""
+    st.session_state.pending_delete_case_id = case_id
+
+
+def _render_tasks_panel_body() -> bool:
+    """Pinta el panel Estado de Tareas; regresa True si hay tareas activas."""
+    st.markdown("### 🧾 Estado de Tareas")
+    st.markdown(_TASK_CHIPS_LEGEND, unsafe_allow_html=True)
+    status_filter = st.selectbox(
+        "Filtrar por estado",
+        options=["ALL", "PENDING", "STARTED", "SUCCESS", "FAILURE", "RETRY", "REVOKED"],
+        index=0,
+    )
+    # Con fragments el panel ya se refresca solo (run_every); el checkbox de
+    # auto-refresh solo aplica al fallback sin fragments.
+    if not hasattr(st, "fragment"):
+        auto_refresh = st.checkbox("Auto-refresh", value=False)
+        if auto_refresh and _AUTOREFRESH is not None:
+            _AUTOREFRESH(interval=5000, key="tasks_autorefresh")
+
+    has_active = False
+    if st.session_state.task_ids:
+        recent_ids = st.session_state.task_ids[-15:]
+        show_all = status_filter == "ALL"
+        statuses = get_task_statuses(recent_ids, status=None if show_all else status_filter)
+        # Una sola pasada con los dicts resueltos fuera del loop: evita
+        # repetir lookups de session_state y .get() por tarea en cada rerun.
+        task_meta = st.session_state.task_meta
+        # Acumula las filas y emite un solo st.markdown: un delta websocket
+        # en lugar de uno por tarea. Los expanders de error (interactivos)
+        # sí requieren llamadas individuales, pero solo para fallos.
+        row_lines: list[str] = []
+        error_rows: list[tuple[str, dict]] = []
+        for tid in recent_ids:
+            status = statuses.get(tid)
+            if status is None:
+                if not show_all:
+                    continue  # descartada por el filtro en el servidor
+                status = {"task_id": tid, "status": "ERROR", "result": None}
+            state = status.get("status")
+            if state in _ACTIVE_STATES:
+                has_active = True
+            meta = task_meta.get(tid) or _EMPTY_META
+            action = meta.get("action", "Tarea")
+            filename = meta.get("filename")
+            label = f"{action}" if not filename else f"{action} - {filename}"
+            row_lines.append(f"- {status_icon(state)} `{tid}` {status_chip(state)}  \n  {label}")
+            if state in {"FAILURE", "RETRY", "ERROR"}:
+                error_rows.append((tid, status))
+        if row_lines:
+            st.markdown("\n".join(row_lines), unsafe_allow_html=True)
+        for tid, status in error_rows:
+            result = status.get("result")
+            traceback_text = status.get("traceback")
+            with st.expander(f"Detalle de error: {tid}", expanded=False):
+                if result is None:
+                    st.write("Sin detalle disponible.")
+                elif isinstance(result, (dict, list)):
+                    st.json(result)
+                else:
+                    st.code(str(result))
+                if traceback_text:
+                    st.caption("Traceback")
+                    st.code(str(traceback_text))
+    else:
+        st.info("No hay tareas recientes.")
+    return has_active
+
+
+if hasattr(st, "fragment"):
+    # El panel se refresca solo (scope de fragmento) sin rerun de página completa.
+    @st.fragment(run_every=3)
+    def render_tasks_panel() -> None:
+        _render_tasks_panel_body()
+else:
+    def render_tasks_panel() -> None:
+        # Sin fragments: delega el refresco al rerun global del pie de página.
+        if _render_tasks_panel_body():
+            st.session_state["_tasks_panel_needs_refresh"] = True
+
+
+if hasattr(st, "fragment"):
+    @st.fragment(run_every=2.5)
+    def _active_tasks_watchdog() -> None:
+        """Se monta solo mientras hay tareas activas: cada tick de run_every
+        dispara un rerun completo sin bloquear el hilo con time.sleep."""
+        # El primer render (inline) solo arma el flag; los ticks posteriores
+        # lo encuentran armado y refrescan la página.
+        if st.session_state.get("_watchdog_armed"):
+            st.session_state["_watchdog_armed"] = False
+            st.rerun(scope="app")
+        st.session_state["_watchdog_armed"] = True
 
 
 def doc_pipeline_status(doc: dict) -> tuple[bool, bool, int, int]:
@@ -217,12 +639,16 @@ def doc_pipeline_status(doc: dict) -> tuple[bool, bool, int, int]:
     return is_classified, is_indexed, chunk_count, indexed_chunk_count
 
 
+# Una sola pasada del motor de regex en vez de un substring-scan por marcador.
+_DUPLICATE_MARKERS_RE = re.compile(r"duplic|exist|already|unique|integrity|constraint")
+
+
 def looks_like_duplicate_case_error(response) -> bool:
     if not response:
         return False
     text_chunks = []
     try:
-        payload = response.json()
+        payload = parse_json(response)
         if isinstance(payload, dict):
             for key in ("detail", "message", "error", "msg"):
                 if key in payload:
@@ -238,25 +664,11 @@ def looks_like_duplicate_case_error(response) -> bool:
         pass
     text_chunks.append(response.text or "")
     haystack = " ".join(text_chunks).lower()
-    duplicate_markers = [
-        "duplic",
-        "exist",
-        "already",
-        "unique",
-        "integrity",
-        "constraint",
-    ]
-    return any(marker in haystack for marker in duplicate_markers)
+    return _DUPLICATE_MARKERS_RE.search(haystack) is not None
 
 
 def risk_badge(level: str) -> str:
-    level = (level or "").upper()
-    return {
-        "CRITICAL": "🔴 Crítico",
-        "HIGH": "🟠 Alto",
-        "MEDIUM": "🟡 Medio",
-        "LOW": "🟢 Bajo",
-    }.get(level, "⚪ Sin clasificar")
+    return _RISK_BADGES.get((level or "").upper(), "⚪ Sin clasificar")
 
 
 FIELD_LABELS = {
@@ -279,7 +691,10 @@ FIELD_LABELS = {
 }
 
 
+@lru_cache(maxsize=512)
 def humanize_field_key(key: str) -> str:
+    # Se invoca por campo y por fila en cada rerun con un vocabulario chico:
+    # memoizar evita rehacer las mismas operaciones de string una y otra vez.
     if not key:
         return "-"
     if key in FIELD_LABELS:
@@ -288,35 +703,57 @@ def humanize_field_key(key: str) -> str:
     return clean[:1].upper() + clean[1:]
 
 
-def humanize_value(value):
-    if value is None:
-        return "-"
-    text = str(value).strip()
+# Tabla de reemplazos a nivel módulo: antes se re-alocaba en cada llamada.
+_VALUE_REPLACEMENTS = {
+    "AUSENTE": "No encontrado",
+    "PRESENTE": "Disponible",
+    "SIN COBERTURA": "Sin evidencia",
+    "INSUFICIENTE": "Información incompleta",
+    "VENCIDO": "Vencido",
+    "FACT": "Hecho",
+    "CLAIM": "Dicho por una de las partes",
+    "CONFLICT": "Conflicto entre documentos",
+    "MISSING": "Falta evidencia",
+    "LOW": "Bajo",
+    "MEDIUM": "Medio",
+    "HIGH": "Alto",
+    "CRITICAL": "Crítico",
+    "DETERMINISTIC": "Determinístico",
+    "HYBRID LLM": "Híbrido con IA",
+}
+
+
+@lru_cache(maxsize=2048)
+def _humanize_text(text: str) -> str:
+    text = text.strip()
     normalized = text.replace("_", " ").upper()
-    replacements = {
-        "AUSENTE": "No encontrado",
-        "PRESENTE": "Disponible",
-        "SIN COBERTURA": "Sin evidencia",
-        "INSUFICIENTE": "Información incompleta",
-        "VENCIDO": "Vencido",
-        "FACT": "Hecho",
-        "CLAIM": "Dicho por una de las partes",
-        "CONFLICT": "Conflicto entre documentos",
-        "MISSING": "Falta evidencia",
-        "LOW": "Bajo",
-        "MEDIUM": "Medio",
-        "HIGH": "Alto",
-        "CRITICAL": "Crítico",
-        "DETERMINISTIC": "Determinístico",
-        "HYBRID LLM": "Híbrido con IA",
-    }
-    if normalized in replacements:
-        return replacements[normalized]
+    if normalized in _VALUE_REPLACEMENTS:
+        return _VALUE_REPLACEMENTS[normalized]
     if "_" in text:
         text = text.replace("_", " ")
     return text
 
 
+def humanize_value(value):
+    if value is None:
+        return "-"
+    # Coerción a str antes de memoizar: los valores (status, niveles de
+    # riesgo, montos) se repiten muchísimo entre facts y reruns.
+    return _humanize_text(str(value))
+
+
+def party_facts_markdown(header: str, facts: list[dict], limit: int = 8) -> str:
+    """Arma la columna del comparativo como un solo bloque markdown.
+
+    Un st.markdown por columna en vez de un st.caption por hecho: menos
+    elementos en el DOM y menos round-trips de render por rerun.
+    """
+    lines = [header]
+    for f in facts[:limit]:
+        lines.append(f":gray[{humanize_field_key(f.get('field_key'))}: {humanize_value(f.get('value_raw'))}]")
+    return "  \n".join(lines)
+
+
 def friendly_alert_text(message: str, field_key: str | None = None, required_doc_type: str | None = None) -> str:
     msg = (message or "").strip()
     if msg.startswith("FALTA_EVIDENCIA:"):
@@ -333,15 +770,22 @@ st.sidebar.header("📁 Mis Expedientes")
 
 if "viewer_doc_id" not in st.session_state:
     set_viewer_state(None)
-if "chat_history" not in st.session_state:
-    st.session_state.chat_history = []
-if "task_ids" not in st.session_state:
-    st.session_state.task_ids = []
-if "task_meta" not in st.session_state:
-    st.session_state.task_meta = {}
+st.session_state.setdefault("chat_history", [])
+st.session_state.setdefault("chat_history_md", [])
+st.session_state.setdefault("task_ids", [])
+st.session_state.setdefault("task_meta", {})
+st.session_state.setdefault("doc_task_index", {})
+# Un solo set con los fact_id expandidos en vez de una clave booleana
+# show_detail_{fact_id} por hecho acumulándose en session_state.
+st.session_state.setdefault("expanded_fact_details", set())
 
 # Cargar casos
 cases = get_cases_cached()
+existing_titles = {
+    str(c.get("title", "")).strip().lower()
+    for c in cases
+    if isinstance(c, dict)
+}
 
 # Formulario Crear
 with st.sidebar.expander("➕ Nuevo Expediente", expanded=False):
@@ -354,11 +798,6 @@ with st.sidebar.expander("➕ Nuevo Expediente", expanded=False):
             if not title_clean:
                 st.error("Nombre obligatorio.")
             else:
-                existing_titles = {
-                    str(c.get("title", "")).strip().lower()
-                    for c in cases
-                    if isinstance(c, dict)
-                }
                 if title_clean.lower() in existing_titles:
                     st.caption("El nombre del caso o cliente ya existe.")
                 else:
@@ -366,8 +805,9 @@ with st.sidebar.expander("➕ Nuevo Expediente", expanded=False):
                         r = safe_request('POST', API_URL, json={"title": title_clean, "description": "App"}, timeout=10)
                         if r and r.status_code in [200, 201]:
                             st.success("¡Creado!")
+                            # Sin sleep: el POST ya respondió con el caso
+                            # creado, basta invalidar la caché y rerenderizar.
                             clear_cache()
-                            time.sleep(0.5)
                             st.rerun()
                         elif (r and r.status_code in [400, 409, 422]) or looks_like_duplicate_case_error(r):
                             if looks_like_duplicate_case_error(r):
@@ -384,8 +824,7 @@ if not cases:
     st.stop() 
 
 # Selector de casos
-cases_map = {c["id"]: c["title"] for c in cases}
-valid_ids = list(cases_map.keys())
+cases_map, valid_ids = get_cases_map_cached()
 selected_case_id = st.sidebar.radio(
     "Seleccionar:", 
     options=valid_ids,
@@ -397,12 +836,38 @@ selected_case_id = st.sidebar.radio(
 if selected_case_id:
     should_force_refresh = False
 
-    # No cacheamos esto para ver los documentos frescos al subir
-    case_res = safe_request('GET', f"{API_URL}/{selected_case_id}", timeout=5)
-
-    if case_res and case_res.status_code == 200:
-        case = case_res.json()
-        st.title(f"📂 {case['title']}")
+    # El detalle del caso y la ficha técnica son independientes: se piden en
+    # paralelo para pagar una sola latencia de backend por rerun.
+    # Invalidación diferida de la ficha: encolar un análisis/build no cambia
+    # nada en el backend todavía; la caché se limpia hasta que la tarea
+    # correspondiente termina en SUCCESS, justo antes del fetch de este rerun.
+    pending_sheet_tasks: dict[str, str] = st.session_state.setdefault("_sheet_tasks_pending", {})
+    if pending_sheet_tasks:
+        sheet_task_statuses = get_task_statuses(list(pending_sheet_tasks))
+        for tid in list(pending_sheet_tasks):
+            state = (sheet_task_statuses.get(tid) or {}).get("status")
+            if state in _TERMINAL_TASK_STATES:
+                task_case_id = pending_sheet_tasks.pop(tid)
+                if state == "SUCCESS":
+                    clear_technical_sheet_cache(task_case_id)
+                    get_case_cached.clear(task_case_id)
+    if pending_sheet_tasks:
+        # Mantén vivo el watchdog hasta observar la transición a terminal.
+        should_force_refresh = True
+
+    # Ventana de frescura según el rerun anterior: 5 s mientras el pipeline
+    # sigue procesando, 5 min cuando el caso ya está en estado estable.
+    sheet_max_age = 5.0 if st.session_state.get("_pipeline_active") or pending_sheet_tasks else 300.0
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        case_future = pool.submit(get_case_cached, selected_case_id)
+        sheet_future = pool.submit(get_technical_sheet_cached, selected_case_id, sheet_max_age)
+    case = case_future.result()
+    technical_sheet = sheet_future.result()
+
+    if case:
+        # Lookups del case que se repiten en el render: una sola vez por rerun.
+        case_title = case["title"]
+        st.title(f"📂 {case_title}")
 
         viewer_active = st.session_state.get("viewer_doc_id") is not None
         if viewer_active:
@@ -411,14 +876,18 @@ if selected_case_id:
                 tab_docs, tab_info, tab_config = st.tabs(["📄 Documentos", "📊 Ficha Técnica", "⚙️ Configuración"])
             with col_right:
                 st.subheader("👁️ Visor del Documento")
-                if st.button("✖️ Cerrar visor"):
-                    set_viewer_state(None)
-                    st.rerun()
+                # on_click corre antes del rerun natural del click: un solo
+                # rerun por interacción en vez de ejecutar el script dos veces.
+                st.button("✖️ Cerrar visor", on_click=set_viewer_state, args=(None,))
                 viewer_doc_id = st.session_state.get("viewer_doc_id")
                 viewer_page = st.session_state.get("viewer_page")
                 viewer_bbox = st.session_state.get("viewer_bbox")
                 pdf_bytes = get_document_bytes(viewer_doc_id) if viewer_doc_id else None
                 if pdf_bytes:
+                    # Import perezoso: el componente (y su bundle JS) solo se
+                    # registra cuando el visor está abierto; Python cachea el
+                    # módulo, así que no hay costo por rerun.
+                    from streamlit_pdf_viewer import pdf_viewer
                     annotations = []
                     ann = bbox_to_annotation(viewer_bbox)
                     if ann:
@@ -439,29 +908,39 @@ if selected_case_id:
                     st.info("Selecciona un documento para visualizar.")
 
                 st.markdown("### 💬 Chat Contextual")
-                question = st.text_input("Pregunta sobre el documento", key="doc_chat_input")
-                if st.button("Preguntar", key="doc_chat_btn") and viewer_doc_id and question:
-                    response = ask_document_chat(viewer_doc_id, question)
-                    st.session_state.chat_history.append({
+                # st.form: escribir en el input no reruns la app; la consulta
+                # solo dispara al enviar (botón o Enter), una interacción = un rerun.
+                with st.form("doc_chat_form", clear_on_submit=False):
+                    question = st.text_input("Pregunta sobre el documento", key="doc_chat_input")
+                    submitted = st.form_submit_button("Preguntar")
+                if submitted and viewer_doc_id and question:
+                    try:
+                        response = ask_document_chat(viewer_doc_id, question)
+                    except ChatBackendError:
+                        response = {"answer": "Error consultando el modelo.", "sources": []}
+                    item = {
                         "q": question,
                         "a": response.get("answer"),
                         "sources": response.get("sources", []),
-                    })
-                for item in reversed(st.session_state.chat_history):
-                    st.markdown(f"**Q:** {item['q']}")
-                    st.markdown(f"**A:** {item['a']}")
-                    if item["sources"]:
-                        st.markdown("Fuentes:")
-                        for s in item["sources"]:
-                            st.write(f"- p{s['page']}: {s['text']}")
+                    }
+                    st.session_state.chat_history.append(item)
+                    # Render incremental: el markdown de cada turno se arma una
+                    # sola vez y los reruns solo re-emiten el bloque ya construido.
+                    st.session_state.chat_history_md.append(chat_item_markdown(item))
+                    # Solo se conservan los últimos _MAX_CHAT_TURNS turnos para
+                    # que el costo por rerun no crezca con toda la conversación.
+                    if len(st.session_state.chat_history) > _MAX_CHAT_TURNS:
+                        st.session_state.chat_history = st.session_state.chat_history[-_MAX_CHAT_TURNS:]
+                        st.session_state.chat_history_md = st.session_state.chat_history_md[-_MAX_CHAT_TURNS:]
+                if st.session_state.chat_history_md:
+                    st.markdown("\n\n---\n\n".join(reversed(st.session_state.chat_history_md)))
         else:
             tab_docs, tab_info, tab_config = st.tabs(["📄 Documentos", "📊 Ficha Técnica", "⚙️ Configuración"])
 
         # TAB 1: DOCUMENTOS
         with tab_docs:
             docs = case.get("documents", [])
-            if "show_upload_panel" not in st.session_state:
-                st.session_state.show_upload_panel = False
+            st.session_state.setdefault("show_upload_panel", False)
             has_docs = len(docs) > 0
 
             show_full_uploader = not has_docs
@@ -482,32 +961,34 @@ if selected_case_id:
                 )
                 if uploaded_files and st.button("Guardar Archivo(s)"):
                     with st.spinner("Subiendo..."):
+                        # Subidas concurrentes y en streaming: el tiempo total
+                        # es el del archivo más lento, no la suma de todos.
+                        with ThreadPoolExecutor(max_workers=4) as pool:
+                            upload_results = list(pool.map(
+                                lambda uf: _upload_document(uf, selected_case_id),
+                                uploaded_files,
+                            ))
                         uploaded_count = 0
                         queued_classify = 0
-                        for uf in uploaded_files:
-                            files = {"file": (uf.name, uf, uf.type)}
-                            data = {"case_id": selected_case_id, "doc_type": "DETECTANDO..."}
-                            r = safe_request('POST', f"{DOCS_URL}/", files=files, data=data, timeout=60)
-                            if r and r.status_code == 200:
-                                uploaded_count += 1
-                                payload = r.json()
-                                doc_id = payload.get("document_id")
-                                if doc_id:
-                                    c_res = safe_request('POST', f"{DOCS_URL}/{doc_id}/process", timeout=60)
-                                    if c_res and c_res.status_code == 200:
-                                        c_payload = c_res.json()
-                                        if c_payload.get("task_id"):
-                                            register_task(
-                                                c_payload["task_id"],
-                                                action="Clasificar documento",
-                                                doc_id=doc_id,
-                                                filename=uf.name,
-                                            )
-                                            queued_classify += 1
+                        for uf, (ok, doc_id, task_id) in zip(uploaded_files, upload_results):
+                            if not ok:
+                                continue
+                            uploaded_count += 1
+                            if task_id:
+                                register_task(
+                                    task_id,
+                                    action="Clasificar documento",
+                                    doc_id=doc_id,
+                                    filename=uf.name,
+                                )
+                                queued_classify += 1
                         if uploaded_count > 0:
                             st.success(f"Se guardaron {uploaded_count} archivo(s). Clasificación automática en progreso ({queued_classify}).")
                             st.session_state.show_upload_panel = False
                             st.session_state[f"pending_index_prompt_{selected_case_id}"] = True
+                            # Invalidación quirúrgica: solo la entrada de este
+                            # expediente; la lista de casos (títulos) no cambió.
+                            get_case_cached.clear(selected_case_id)
                             st.rerun()
                         else:
                             st.error("No se pudo guardar ningún archivo.")
@@ -516,8 +997,7 @@ if selected_case_id:
             st.caption("Estados: clasificado e indexado siempre visibles")
             has_active_doc_tasks = False
             selection_key = f"selected_docs_{selected_case_id}"
-            if selection_key not in st.session_state:
-                st.session_state[selection_key] = []
+            st.session_state.setdefault(selection_key, [])
             if docs:
                 doc_map = {d["id"]: d for d in docs}
                 selected_docs = [d for d in st.session_state[selection_key] if d in doc_map]
@@ -529,110 +1009,137 @@ if selected_case_id:
                 with toolbar_right:
                     st.caption(f"Seleccionados: {len(selected_docs)} de {len(docs)}")
 
+                # El nonce re-monta el data_editor cuando la selección cambia
+                # desde fuera (Todo/Limpiar), porque el widget conserva su
+                # estado editado mientras la key no cambie.
+                nonce_key = f"_docs_editor_nonce_{selected_case_id}"
+                st.session_state.setdefault(nonce_key, 0)
                 if act1.button("☑️ Todo", key=f"sel_all_{selected_case_id}", use_container_width=True):
                     st.session_state[selection_key] = [d["id"] for d in docs]
+                    st.session_state[nonce_key] += 1
                     st.rerun()
                 if act2.button("⬜ Limpiar", key=f"clear_sel_{selected_case_id}", use_container_width=True):
                     st.session_state[selection_key] = []
+                    st.session_state[nonce_key] += 1
                     st.rerun()
                 if act3.button("🧠 Indexar", key=f"bulk_index_{selected_case_id}", disabled=len(selected_docs) == 0, use_container_width=True):
-                    pending_to_index = [doc_map[doc_id] for doc_id in selected_docs if not bool(doc_map[doc_id].get("is_indexed"))]
+                    # Un solo lookup por id y sin bool() por elemento.
+                    pending_to_index = [
+                        d for d in (doc_map.get(i) for i in selected_docs)
+                        if d and not d.get("is_indexed")
+                    ]
                     if not pending_to_index:
                         st.info("Los documentos seleccionados ya están indexados.")
                     else:
-                        for doc in pending_to_index:
-                            res = safe_request('POST', f"{DOCS_URL}/{doc['id']}/embed", timeout=120)
-                            if res and res.status_code == 200:
-                                payload = res.json()
-                                if payload.get("task_id"):
-                                    register_task(
-                                        payload["task_id"],
-                                        action="Indexar embeddings",
-                                        doc_id=doc["id"],
-                                        filename=doc["filename"],
-                                    )
-                        st.success(f"Indexación en cola para {len(pending_to_index)} documento(s).")
+                        # Un solo POST batcheado: el backend encola las N tareas.
+                        queued = queue_embeddings_batch(pending_to_index)
+                        st.success(f"Indexación en cola para {queued} documento(s).")
                         st.rerun()
                 if act4.button("🗑️ Borrar", key=f"bulk_delete_{selected_case_id}", disabled=len(selected_docs) == 0, use_container_width=True):
-                    deleted = 0
-                    for doc_id in selected_docs:
-                        res = safe_request('DELETE', f"{DOCS_URL}/{doc_id}")
-                        if res and res.status_code == 200:
-                            deleted += 1
+                    with ThreadPoolExecutor(max_workers=8) as pool:
+                        delete_responses = pool.map(
+                            lambda d: safe_request('DELETE', f"{DOCS_URL}/{d}"),
+                            selected_docs,
+                        )
+                    deleted = sum(1 for res in delete_responses if res and res.status_code == 200)
                     st.session_state[selection_key] = []
                     st.success(f"Se eliminaron {deleted} documento(s).")
+                    get_case_cached.clear(selected_case_id)
                     st.rerun()
-                if act5.button("👁️ Ver", key=f"bulk_view_{selected_case_id}", disabled=len(selected_docs) != 1, use_container_width=True):
-                    only_doc_id = selected_docs[0]
-                    set_viewer_state(only_doc_id, page=1, bbox=None)
-                    st.rerun()
+                act5.button(
+                    "👁️ Ver",
+                    key=f"bulk_view_{selected_case_id}",
+                    disabled=len(selected_docs) != 1,
+                    use_container_width=True,
+                    on_click=set_viewer_state,
+                    args=(selected_docs[0] if len(selected_docs) == 1 else None,),
+                    kwargs={"page": 1, "bbox": None},
+                )
                 if act6.button("↻", key=f"refresh_docs_{selected_case_id}", use_container_width=True):
                     clear_cache()
                     st.rerun()
 
                 st.markdown("---")
-                hdr = st.columns([0.6, 4.5, 2.2, 2.2])
-                hdr[0].caption("Sel.")
-                hdr[1].caption("Documento")
-                hdr[2].caption("Clasificación")
-                hdr[3].caption("Indexación")
 
                 all_classified = True
+                # Prefetch batcheado de los estados de tarea de todas las filas:
+                # un round-trip (o ninguno, si todo es terminal memoizado) en
+                # lugar de 2 consultas por documento dentro del loop.
+                doc_task_index = st.session_state.doc_task_index
+                row_tids = [
+                    tid
+                    for d in docs
+                    for action in ("Clasificar documento", "Indexar embeddings")
+                    if (tid := doc_task_index.get((d["id"], action))) is not None
+                ]
+                row_statuses = get_task_statuses(row_tids) if row_tids else {}
+                # Una sola tabla editable en lugar de 4 widgets por documento:
+                # N×4 deltas de render se vuelven 1 data_editor por rerun.
+                selection_set = set(st.session_state[selection_key])
+                editor_rows = []
                 for doc in docs:
                     is_classified, is_indexed, chunk_count, indexed_chunk_count = doc_pipeline_status(doc)
                     if not is_classified:
                         all_classified = False
                     doc_id = doc["id"]
-                    check_key = f"doc_sel_{selected_case_id}_{doc_id}"
-                    st.session_state[check_key] = doc_id in st.session_state[selection_key]
-                    row = st.columns([0.6, 4.5, 2.2, 2.2])
-                    checked = row[0].checkbox("", key=check_key, label_visibility="collapsed")
-                    if checked and doc_id not in st.session_state[selection_key]:
-                        st.session_state[selection_key].append(doc_id)
-                    if (not checked) and doc_id in st.session_state[selection_key]:
-                        st.session_state[selection_key].remove(doc_id)
-
                     doc_type = doc.get("doc_type") or "SIN_CLASIFICAR"
-                    row[1].markdown(f"**{doc['filename']}**  \n:gray[{humanize_field_key(doc_type)}]")
-                    row[2].caption("🟢 Listo" if is_classified else "🟡 En proceso")
-                    row[3].caption(
-                        f"🟢 Listo ({indexed_chunk_count}/{chunk_count})"
-                        if is_indexed
-                        else f"🟡 Pendiente ({indexed_chunk_count}/{chunk_count})"
+                    editor_rows.append(
+                        {
+                            "sel": doc_id in selection_set,
+                            "documento": doc["filename"],
+                            "tipo": humanize_field_key(doc_type),
+                            "clasificacion": "🟢 Listo" if is_classified else "🟡 En proceso",
+                            "indexacion": (
+                                f"🟢 Listo ({indexed_chunk_count}/{chunk_count})"
+                                if is_indexed
+                                else f"🟡 Pendiente ({indexed_chunk_count}/{chunk_count})"
+                            ),
+                            "_id": doc_id,
+                        }
                     )
 
-                    classify_tid, classify_state = find_latest_doc_task(doc_id, "Clasificar documento")
-                    if classify_state in {"PENDING", "STARTED"}:
+                    classify_tid, classify_state = find_latest_doc_task(
+                        doc_id, "Clasificar documento", statuses=row_statuses
+                    )
+                    if classify_state in _ACTIVE_STATES:
                         has_active_doc_tasks = True
                         should_force_refresh = True
-                    embed_tid, embed_state = find_latest_doc_task(doc_id, "Indexar embeddings")
-                    if embed_state in {"PENDING", "STARTED"}:
+                    embed_tid, embed_state = find_latest_doc_task(
+                        doc_id, "Indexar embeddings", statuses=row_statuses
+                    )
+                    if embed_state in _ACTIVE_STATES:
                         has_active_doc_tasks = True
                         should_force_refresh = True
 
+                edited_rows = st.data_editor(
+                    editor_rows,
+                    key=f"docs_editor_{selected_case_id}_{st.session_state[nonce_key]}",
+                    column_config={
+                        "sel": st.column_config.CheckboxColumn("Sel.", default=False),
+                        "documento": st.column_config.TextColumn("Documento"),
+                        "tipo": st.column_config.TextColumn("Tipo"),
+                        "clasificacion": st.column_config.TextColumn("Clasificación"),
+                        "indexacion": st.column_config.TextColumn("Indexación"),
+                        "_id": None,
+                    },
+                    disabled=["documento", "tipo", "clasificacion", "indexacion"],
+                    hide_index=True,
+                    use_container_width=True,
+                )
+                # Escritura única de la selección marcada en la tabla.
+                st.session_state[selection_key] = [r["_id"] for r in edited_rows if r["sel"]]
+
                 prompt_key = f"pending_index_prompt_{selected_case_id}"
                 dismiss_key = f"dismissed_index_prompt_{selected_case_id}"
-                any_unindexed = any(not bool(d.get("is_indexed")) for d in docs)
-                if prompt_key not in st.session_state:
-                    st.session_state[prompt_key] = False
-                if dismiss_key not in st.session_state:
-                    st.session_state[dismiss_key] = False
+                any_unindexed = any(not d.get("is_indexed") for d in docs)
+                st.session_state.setdefault(prompt_key, False)
+                st.session_state.setdefault(dismiss_key, False)
                 if all_classified and any_unindexed and st.session_state[prompt_key] and not st.session_state[dismiss_key]:
                     st.info("Todos los documentos ya están clasificados. ¿Deseas indexarlos ahora?")
                     p1, p2 = st.columns(2)
                     if p1.button("Sí, indexar ahora", key=f"prompt_index_now_{selected_case_id}"):
-                        to_index = [d for d in docs if not bool(d.get("is_indexed"))]
-                        for doc in to_index:
-                            res = safe_request('POST', f"{DOCS_URL}/{doc['id']}/embed", timeout=120)
-                            if res and res.status_code == 200:
-                                payload = res.json()
-                                if payload.get("task_id"):
-                                    register_task(
-                                        payload["task_id"],
-                                        action="Indexar embeddings",
-                                        doc_id=doc["id"],
-                                        filename=doc["filename"],
-                                    )
+                        to_index = [d for d in docs if not d.get("is_indexed")]
+                        queue_embeddings_batch(to_index)
                         st.session_state[prompt_key] = False
                         st.session_state[dismiss_key] = True
                         st.success("Indexación en cola.")
@@ -644,16 +1151,16 @@ if selected_case_id:
             else:
                 st.info("Carpeta vacía.")
 
+            st.session_state["_pipeline_active"] = has_active_doc_tasks
             if has_active_doc_tasks:
                 st.caption("Actualizando estado de tareas...")
-                try:
-                    st.autorefresh(interval=3000, key=f"docs_tasks_autorefresh_{selected_case_id}")
-                except Exception:
-                    pass
+                # El watchdog de pie de página (fragment) ya refresca la página
+                # mientras haya tareas activas; autorefresh queda de fallback.
+                if not hasattr(st, "fragment") and _AUTOREFRESH is not None:
+                    _AUTOREFRESH(interval=3000, key=f"docs_tasks_autorefresh_{selected_case_id}")
 
         # TAB 2: FICHA TÉCNICA
         with tab_info:
-            technical_sheet = get_technical_sheet_cached(selected_case_id)
             st.markdown("### 🧾 Resumen rápido con fuentes")
             meta = case.get("metadata_info")
             col_met, col_btn = st.columns([3, 1])
@@ -698,15 +1205,22 @@ if selected_case_id:
                         "bbox": fs.get("source_bbox"),
                     })
                 if fields:
-                    for i, field in enumerate(fields):
+                    for field in fields:
                         row = st.columns([2, 1])
                         row[0].metric(field["label"], field["value"])
+                        # Clave estable por campo+documento: si un campo aparece o
+                        # desaparece, los demás botones no cambian de identidad y
+                        # Streamlit no los desmonta/remonta.
                         if field["doc_id"] and field["page"]:
-                            if row[1].button("🔗 Ver Fuente", key=f"src_{i}_{field['doc_id']}"):
-                                set_viewer_state(field["doc_id"], page=field["page"], bbox=field["bbox"])
-                                st.rerun()
+                            row[1].button(
+                                "🔗 Ver Fuente",
+                                key=f"src_{field['label']}_{field['doc_id']}",
+                                on_click=set_viewer_state,
+                                args=(field["doc_id"],),
+                                kwargs={"page": field["page"], "bbox": field["bbox"]},
+                            )
                         else:
-                            row[1].button("🔗 Ver Fuente", key=f"src_{i}_disabled", disabled=True)
+                            row[1].button("🔗 Ver Fuente", key=f"src_dis_{field['label']}", disabled=True)
                 else:
                     st.info("No se han extraído datos clave aún.")
             with col_btn:
@@ -714,7 +1228,7 @@ if selected_case_id:
                     with st.spinner("Analizando..."):
                         res = safe_request('POST', f"{API_URL}/{selected_case_id}/extract-metadata", timeout=60)
                         if res and res.status_code == 200:
-                            payload = res.json()
+                            payload = parse_json(res)
                             st.success(f"En cola: {payload.get('task_id', 'analizando')}")
                             if payload.get("task_id"):
                                 register_task(
@@ -723,7 +1237,7 @@ if selected_case_id:
                                     doc_id=None,
                                     filename=None,
                                 )
-                            get_technical_sheet_cached.clear()
+                                st.session_state["_sheet_tasks_pending"][payload["task_id"]] = selected_case_id
                             st.rerun()
                         else:
                             st.error("Error al analizar.")
@@ -736,7 +1250,7 @@ if selected_case_id:
                     with st.spinner("Construyendo ficha técnica 360..."):
                         res = safe_request('POST', f"{API_URL}/{selected_case_id}/build-technical-sheet", timeout=30)
                         if res and res.status_code == 200:
-                            payload = res.json()
+                            payload = parse_json(res)
                             st.success(f"En cola: {payload.get('task_id', 'build')}")
                             if payload.get("task_id"):
                                 register_task(
@@ -745,19 +1259,23 @@ if selected_case_id:
                                     doc_id=None,
                                     filename=None,
                                 )
-                            get_technical_sheet_cached.clear()
+                                st.session_state["_sheet_tasks_pending"][payload["task_id"]] = selected_case_id
                             st.rerun()
                         else:
                             st.warning("⚠️ No se pudo encolar la construcción de ficha 360.")
             with ctl_b:
                 if st.button("🔄 Refrescar Ficha 360", key="refresh_techsheet_btn"):
-                    get_technical_sheet_cached.clear()
+                    clear_technical_sheet_cache(selected_case_id)
                     st.rerun()
 
             if technical_sheet:
-                summary = technical_sheet.get("executive_summary", {})
+                # Destructure único de la ficha: cada sub-dict se resuelve una
+                # vez al entrar al bloque, no en cada sección que lo usa.
+                summary = technical_sheet.get("executive_summary") or {}
                 missing_required = technical_sheet.get("missing_required_docs") or []
                 conflicts = technical_sheet.get("conflicts") or []
+                pillars = technical_sheet.get("pillars") or {}
+                sheet_facts = technical_sheet.get("facts") or []
                 if missing_required:
                     st.markdown("#### 📌 Documentos obligatorios faltantes")
                     for alert in missing_required:
@@ -782,9 +1300,14 @@ if selected_case_id:
                         src_doc = c.get("source_doc_id")
                         src_page = c.get("source_page")
                         src_bbox = c.get("source_bbox")
-                        if src_doc and src_page and st.button("🔗 Ver documento fuente", key=f"conf_src_{c.get('id')}"):
-                            set_viewer_state(src_doc, page=src_page, bbox=src_bbox)
-                            st.rerun()
+                        if src_doc and src_page:
+                            st.button(
+                                "🔗 Ver documento fuente",
+                                key=f"conf_src_{c.get('id')}",
+                                on_click=set_viewer_state,
+                                args=(src_doc,),
+                                kwargs={"page": src_page, "bbox": src_bbox},
+                            )
                     if len(conflicts) > 3:
                         with st.expander(f"Ver todas las contradicciones ({len(conflicts)})", expanded=False):
                             for c in conflicts[3:]:
@@ -794,9 +1317,13 @@ if selected_case_id:
                                 src_page = c.get("source_page")
                                 src_bbox = c.get("source_bbox")
                                 if src_doc and src_page:
-                                    if st.button("🔗 Ver documento fuente", key=f"conf_src_more_{c.get('id')}"):
-                                        set_viewer_state(src_doc, page=src_page, bbox=src_bbox)
-                                        st.rerun()
+                                    st.button(
+                                        "🔗 Ver documento fuente",
+                                        key=f"conf_src_more_{c.get('id')}",
+                                        on_click=set_viewer_state,
+                                        args=(src_doc,),
+                                        kwargs={"page": src_page, "bbox": src_bbox},
+                                    )
 
                 overall = (summary.get("overall_status") or "YELLOW").upper()
                 semaphore = {
@@ -835,25 +1362,36 @@ if selected_case_id:
                             for msg in visible_alerts[3:]:
                                 st.warning(friendly_alert_text(msg))
 
-                pillars = technical_sheet.get("pillars") or {}
                 fx_a, fx_b, fx_c = st.columns(3)
                 only_critical = fx_a.checkbox("Solo riesgo crítico", value=False, key="tech_only_critical")
                 only_missing = fx_b.checkbox("Solo faltantes de información", value=False, key="tech_only_missing")
                 only_conflict = fx_c.checkbox("Solo contradicciones", value=(len(missing_required) == 0), key="tech_only_conflict")
                 only_authority = st.checkbox("Solo fuentes de autoridad", value=False, key="tech_only_authority")
+                # Predicados armados una sola vez según los checkboxes activos:
+                # sin filtros, los facts pasan directo sin .upper() por campo.
+                fact_checks = []
+                if only_critical:
+                    fact_checks.append(lambda f: (f.get("risk_level") or "").upper() == "CRITICAL")
+                if only_missing:
+                    fact_checks.append(lambda f: (f.get("truth_status") or "").upper() == "MISSING")
+                if only_conflict:
+                    fact_checks.append(lambda f: (f.get("truth_status") or "").upper() == "CONFLICT")
+                if only_authority:
+                    fact_checks.append(lambda f: (f.get("party_side") or "").upper() == "AUTORIDAD")
                 for pillar_name, facts in pillars.items():
-                    filtered_facts = []
-                    for fact in facts:
-                        if only_critical and (fact.get("risk_level") or "").upper() != "CRITICAL":
-                            continue
-                        if only_missing and (fact.get("truth_status") or "").upper() != "MISSING":
-                            continue
-                        if only_conflict and (fact.get("truth_status") or "").upper() != "CONFLICT":
-                            continue
-                        if only_authority and (fact.get("party_side") or "").upper() != "AUTORIDAD":
-                            continue
-                        filtered_facts.append(fact)
-                    with st.expander(f"{pillar_name} ({len(facts)})", expanded=False):
+                    if fact_checks:
+                        filtered_facts = [
+                            fact for fact in facts
+                            if all(check(fact) for check in fact_checks)
+                        ]
+                    else:
+                        filtered_facts = facts
+                    # st.expander evalúa su cuerpo aunque esté colapsado; con un
+                    # toggle propio las filas cerradas no se renderizan en
+                    # absoluto (cero st.columns/botones por pilar colapsado).
+                    if not st.toggle(f"{pillar_name} ({len(facts)})", key=f"exp_pillar_{pillar_name}"):
+                        continue
+                    with st.container(border=True):
                         if not filtered_facts:
                             st.caption("Sin datos.")
                             continue
@@ -869,14 +1407,22 @@ if selected_case_id:
                             src_bbox = fact.get("source_bbox")
                             fact_id = fact.get("id", "")
                             if src_doc and src_page:
-                                if row[3].button("🔗 Ver Fuente", key=f"tech_src_{fact_id}"):
-                                    set_viewer_state(src_doc, page=src_page, bbox=src_bbox)
-                                    st.rerun()
+                                row[3].button(
+                                    "🔗 Ver Fuente",
+                                    key=f"tech_src_{fact_id}",
+                                    on_click=set_viewer_state,
+                                    args=(src_doc,),
+                                    kwargs={"page": src_page, "bbox": src_bbox},
+                                )
                             else:
                                 row[3].button("🔗 Ver Fuente", key=f"tech_src_dis_{fact_id}", disabled=True)
+                            expanded_details = st.session_state.expanded_fact_details
                             if row[4].button("ℹ️ Detalle", key=f"tech_detail_{fact_id}"):
-                                st.session_state[f"show_detail_{fact_id}"] = not st.session_state.get(f"show_detail_{fact_id}", False)
-                            if st.session_state.get(f"show_detail_{fact_id}", False):
+                                if fact_id in expanded_details:
+                                    expanded_details.discard(fact_id)
+                                else:
+                                    expanded_details.add(fact_id)
+                            if fact_id in expanded_details:
                                 st.caption(f"Regla: {fact.get('rule_applied') or '-'}")
                                 st.code(str(fact.get("value_normalized") or {}))
                                 excerpt = fact.get("source_text_excerpt")
@@ -886,23 +1432,22 @@ if selected_case_id:
                                     st.error(f"Qué faltó: {fact.get('why_critical') or 'Evidencia crítica ausente.'}")
                                     st.info(f"Qué documento lo resolvería: {fact.get('evidence_hint') or 'Agregar documento obligatorio del campo.'}")
 
-                cmp_empresa = [f for f in (technical_sheet.get("facts") or []) if (f.get("party_side") or "").upper() == "EMPRESA"]
-                cmp_autoridad = [f for f in (technical_sheet.get("facts") or []) if (f.get("party_side") or "").upper() == "AUTORIDAD"]
-                cmp_trabajador = [f for f in (technical_sheet.get("facts") or []) if (f.get("party_side") or "").upper() == "TRABAJADOR"]
+                # Un solo recorrido de facts bucketeado por parte, en vez de
+                # tres comprehensions que releen y re-upper-ean la misma lista.
+                party_buckets: dict[str, list] = {}
+                for f in sheet_facts:
+                    party_buckets.setdefault((f.get("party_side") or "").upper(), []).append(f)
+                cmp_empresa = party_buckets.get("EMPRESA", [])
+                cmp_autoridad = party_buckets.get("AUTORIDAD", [])
+                cmp_trabajador = party_buckets.get("TRABAJADOR", [])
                 st.markdown("#### 🧭 Comparativo de Fuentes")
                 col_emp, col_aut, col_tra = st.columns(3)
                 with col_emp:
-                    st.markdown("**🔵 Empresa**")
-                    for f in cmp_empresa[:8]:
-                        st.caption(f"{humanize_field_key(f.get('field_key'))}: {humanize_value(f.get('value_raw'))}")
+                    st.markdown(party_facts_markdown("**🔵 Empresa**", cmp_empresa))
                 with col_aut:
-                    st.markdown("**⚫ Autoridad**")
-                    for f in cmp_autoridad[:8]:
-                        st.caption(f"{humanize_field_key(f.get('field_key'))}: {humanize_value(f.get('value_raw'))}")
+                    st.markdown(party_facts_markdown("**⚫ Autoridad**", cmp_autoridad))
                 with col_tra:
-                    st.markdown("**🔴 Trabajador**")
-                    for f in cmp_trabajador[:8]:
-                        st.caption(f"{humanize_field_key(f.get('field_key'))}: {humanize_value(f.get('value_raw'))}")
+                    st.markdown(party_facts_markdown("**🔴 Trabajador**", cmp_trabajador))
             else:
                 st.caption("Construye la Ficha 360 para ver semáforo, narrativa y smart fields.")
 
@@ -910,93 +1455,43 @@ if selected_case_id:
         with tab_config:
             st.header("⚙️ Administración")
             st.warning("Zona de Peligro")
-            st.markdown("### 🧾 Estado de Tareas")
-            st.markdown(
-                """
-                <div>
-                    <span class="badge-chip chip-pending">PENDING</span>
-                    <span class="badge-chip chip-started">STARTED</span>
-                    <span class="badge-chip chip-success">SUCCESS</span>
-                    <span class="badge-chip chip-failure">FAILURE/ERROR</span>
-                    <span class="badge-chip chip-retry">RETRY</span>
-                    <span class="badge-chip chip-revoked">REVOKED</span>
-                </div>
-                """,
-                unsafe_allow_html=True,
-            )
-            auto_refresh = st.checkbox("Auto-refresh", value=False)
-            status_filter = st.selectbox(
-                "Filtrar por estado",
-                options=["ALL", "PENDING", "STARTED", "SUCCESS", "FAILURE", "RETRY", "REVOKED"],
-                index=0,
-            )
-            if auto_refresh:
-                try:
-                    st.autorefresh(interval=5000, key="tasks_autorefresh")
-                except Exception:
-                    pass
-
-            if st.session_state.task_ids:
-                recent_ids = list(dict.fromkeys(st.session_state.task_ids))[-15:]
-                for tid in recent_ids:
-                    status = get_task_status(tid)
-                    state = status.get("status")
-                    if status_filter != "ALL" and state != status_filter:
-                        continue
-                    if state in {"PENDING", "STARTED"}:
-                        should_force_refresh = True
-                    meta = st.session_state.task_meta.get(tid, {})
-                    action = meta.get("action", "Tarea")
-                    filename = meta.get("filename")
-                    label = f"{action}" if not filename else f"{action} - {filename}"
-                    st.markdown(
-                        f"- {status_icon(state)} `{tid}` {status_chip(state)}  \n  {label}",
-                        unsafe_allow_html=True,
-                    )
-                    if state in {"FAILURE", "RETRY", "ERROR"}:
-                        result = status.get("result")
-                        traceback_text = status.get("traceback")
-                        with st.expander(f"Detalle de error: {tid}", expanded=False):
-                            if result is None:
-                                st.write("Sin detalle disponible.")
-                            elif isinstance(result, (dict, list)):
-                                st.json(result)
-                            else:
-                                st.code(str(result))
-                            if traceback_text:
-                                st.caption("Traceback")
-                                st.code(str(traceback_text))
-            else:
-                st.info("No hay tareas recientes.")
-            if f"del_confirm_{selected_case_id}" not in st.session_state:
-                st.session_state[f"del_confirm_{selected_case_id}"] = False
-
-            if not st.session_state[f"del_confirm_{selected_case_id}"]:
-                if st.button("🗑️ ELIMINAR EXPEDIENTE COMPLETO"):
-                    st.session_state[f"del_confirm_{selected_case_id}"] = True
-                    st.rerun()
+            render_tasks_panel()
+            # Un solo escalar en session_state para el caso pendiente de borrar
+            # (en vez de un booleano por expediente). Los flips del flag van en
+            # callbacks on_click, que corren antes del rerun natural del click:
+            # así cada interacción cuesta un solo rerun, sin st.rerun() extra.
+            if st.session_state.get("pending_delete_case_id") != selected_case_id:
+                st.button(
+                    "🗑️ ELIMINAR EXPEDIENTE COMPLETO",
+                    on_click=_set_pending_delete,
+                    args=(selected_case_id,),
+                )
             else:
-                st.error(f"¿Estás seguro de borrar '{case['title']}'?")
+                st.error(f"¿Estás seguro de borrar '{case_title}'?")
                 c_yes, c_no = st.columns(2)
                 with c_yes:
                     if st.button("SÍ, ELIMINAR", type="primary"):
                         res = safe_request('DELETE', f"{API_URL}/{selected_case_id}")
                         if res and res.status_code == 200:
-                            st.success("Caso eliminado.")
+                            # Aviso no bloqueante y rerun inmediato: el sleep(1)
+                            # solo retrasaba la transición tras el borrado.
+                            st.toast("Caso eliminado.")
                             clear_cache() # 🧹 Limpieza obligatoria
-                            time.sleep(1)
+                            clear_technical_sheet_cache(selected_case_id)
+                            st.session_state.pending_delete_case_id = None
                             st.rerun()
                         else:
                             st.error("Error al eliminar.")
                 with c_no:
-                    if st.button("CANCELAR"):
-                        st.session_state[f"del_confirm_{selected_case_id}"] = False
-                        st.rerun()
+                    st.button("CANCELAR", on_click=_set_pending_delete, args=(None,))
     else:
         st.warning("No se pudo cargar el expediente. Posiblemente fue eliminado.")
 
-if selected_case_id and should_force_refresh:
+if selected_case_id and (should_force_refresh or st.session_state.pop("_tasks_panel_needs_refresh", False)):
     # Refresco continuo mientras existan tareas activas para evitar
     # que la UI se quede en PENDING/STARTED hasta una interacción manual.
-    time.sleep(2.5)
-    st.rerun()
+    if hasattr(st, "fragment"):
+        _active_tasks_watchdog()
+    else:
+        time.sleep(2.5)
+        st.rerun()
@@ -1,41 +1,105 @@
 from __future__ import annotations
 
 import argparse
-import json
 import os
+import random
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from typing import Any
 
 import mlflow
-import requests
+from _eval_common import SESSION, compare_case, json_dumps, json_loads, load_expected, summarize
 
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 DATASET_ROOT = Path(__file__).parent / "datasets" / "techsheet_v1"
-CRITICAL_FIELDS = {"start_date_real", "salary_sd", "termination_cause"}
 
-
-def fetch_sheet(case_id: str) -> tuple[dict | None, float]:
+# Caché persistente de (etag, stats) por caso: en barridos consecutivos un
+# 304 del backend evita descargar la ficha y recompararla cuando ni la
+# ficha ni el expected cambiaron.
+_SHEET_CACHE_PATH = Path(
+    os.getenv(
+        "EVAL_SHEET_CACHE",
+        str(Path.home() / ".cache" / "evidence-crusher" / "eval_sheet_cache.json"),
+    )
+)
+_SHEET_CACHE: dict[str, dict] = {}
+_sheet_cache_lock = threading.Lock()
+
+
+def _load_sheet_cache() -> dict[str, dict]:
+    try:
+        return json_loads(_SHEET_CACHE_PATH.read_bytes())
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_sheet_cache() -> None:
+    try:
+        _SHEET_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _SHEET_CACHE_PATH.write_text(json_dumps(_SHEET_CACHE), encoding="utf-8")
+    except OSError:
+        pass
+
+
+def fetch_sheet(case_id: str, etag: str | None = None) -> tuple[dict | None, float, str | None]:
+    """Regresa (sheet, latencia_ms, etag).
+
+    Con un etag previo manda If-None-Match; un 304 regresa sheet=None con el
+    mismo etag para señalar "sin cambios".
+    """
+    headers = {"If-None-Match": etag} if etag else None
     started = time.perf_counter()
-    res = requests.get(f"{BACKEND_URL}/api/v1/cases/{case_id}/technical-sheet", timeout=25)
+    res = SESSION.get(
+        f"{BACKEND_URL}/api/v1/cases/{case_id}/technical-sheet",
+        timeout=25,
+        headers=headers,
+    )
     latency_ms = (time.perf_counter() - started) * 1000.0
+    if res.status_code == 304:
+        return None, latency_ms, etag
     if res.status_code != 200:
-        return None, latency_ms
-    return res.json(), latency_ms
+        return None, latency_ms, None
+    return res.json(), latency_ms, res.headers.get("ETag")
 
 
 def trigger_build(case_id: str) -> str | None:
-    res = requests.post(f"{BACKEND_URL}/api/v1/cases/{case_id}/build-technical-sheet", timeout=25)
+    res = SESSION.post(f"{BACKEND_URL}/api/v1/cases/{case_id}/build-technical-sheet", timeout=25)
     if res.status_code != 200:
         return None
     payload = res.json()
     return payload.get("task_id")
 
 
+def trigger_build_many(case_ids: list[str]) -> dict[str, str]:
+    """Encola el build de todos los casos en un solo POST batch.
+
+    Regresa {case_id: task_id}; si el endpoint batch no está disponible,
+    cae al POST por caso.
+    """
+    if case_ids:
+        res = SESSION.post(
+            f"{BACKEND_URL}/api/v1/cases/batch/build-technical-sheet",
+            json={"case_ids": case_ids},
+            timeout=25,
+        )
+        if res.status_code == 200:
+            return {
+                t["case_id"]: t["task_id"]
+                for t in res.json().get("tasks", [])
+                if t.get("case_id") and t.get("task_id")
+            }
+    return {cid: tid for cid in case_ids if (tid := trigger_build(cid)) is not None}
+
+
 def wait_task(task_id: str, timeout_sec: int = 180) -> tuple[str, float]:
     started = time.perf_counter()
+    # Backoff exponencial con jitter: los jobs cortos se detectan en
+    # fracciones de segundo y los largos no martillean el endpoint cada 2s.
+    delay = 0.25
     while True:
-        status_res = requests.get(f"{BACKEND_URL}/api/v1/tasks/{task_id}", timeout=20)
+        status_res = SESSION.get(f"{BACKEND_URL}/api/v1/tasks/{task_id}", timeout=20)
         if status_res.status_code != 200:
             return "ERROR", (time.perf_counter() - started)
         payload = status_res.json()
@@ -44,76 +108,64 @@ def wait_task(task_id: str, timeout_sec: int = 180) -> tuple[str, float]:
             return status, (time.perf_counter() - started)
         if (time.perf_counter() - started) > timeout_sec:
             return "TIMEOUT", (time.perf_counter() - started)
-        time.sleep(2)
-
-
-def index_facts_by_key(sheet: dict) -> dict[str, dict]:
-    facts = sheet.get("facts") or []
-    return {f.get("field_key"): f for f in facts if f.get("field_key")}
-
-
-def compare_case(expected: dict, sheet: dict) -> dict[str, Any]:
-    facts_by_key = index_facts_by_key(sheet)
-    expected_fields = expected.get("expected_fields", {})
-
-    total_fields = len(expected_fields)
-    matched_fields = 0
-    non_missing_fields = 0
-    critical_total = 0
-    critical_present = 0
-    invented_facts = 0
-
-    for key, exp in expected_fields.items():
-        fact = facts_by_key.get(key)
-        if not fact:
-            continue
-        truth_status = (fact.get("truth_status") or "").upper()
-        if truth_status != "MISSING":
-            non_missing_fields += 1
-        if key in CRITICAL_FIELDS:
-            critical_total += 1
-            if truth_status != "MISSING":
-                critical_present += 1
-        expected_value = exp.get("value")
-        actual_value = fact.get("value_raw")
-        if expected_value is None:
-            if truth_status == "MISSING":
-                matched_fields += 1
-        elif str(expected_value).strip().lower() == str(actual_value).strip().lower():
-            matched_fields += 1
-
-    for fact in sheet.get("facts", []):
-        if not fact.get("source_doc_id") and not fact.get("rule_applied"):
-            invented_facts += 1
-
-    return {
-        "total_fields": total_fields,
-        "matched_fields": matched_fields,
-        "non_missing_fields": non_missing_fields,
-        "critical_total": critical_total,
-        "critical_present": critical_present,
-        "invented_facts": invented_facts,
-    }
-
-
-def summarize(valid_results: list[dict[str, Any]]) -> dict[str, float]:
-    total_fields = sum(r["total_fields"] for r in valid_results)
-    matched_fields = sum(r["matched_fields"] for r in valid_results)
-    non_missing = sum(r["non_missing_fields"] for r in valid_results)
-    critical_total = sum(r["critical_total"] for r in valid_results)
-    critical_present = sum(r["critical_present"] for r in valid_results)
-    invented_facts = sum(r["invented_facts"] for r in valid_results)
-
-    coverage = (non_missing / total_fields * 100.0) if total_fields else 0.0
-    accuracy = (matched_fields / total_fields * 100.0) if total_fields else 0.0
-    critical_coverage = (critical_present / critical_total * 100.0) if critical_total else 0.0
-
-    return {
-        "coverage_pct": round(coverage, 4),
-        "accuracy_pct": round(accuracy, 4),
-        "critical_coverage_pct": round(critical_coverage, 4),
-        "invented_facts": float(invented_facts),
-    }
+        time.sleep(delay + random.uniform(0, delay * 0.5))
+        delay = min(delay * 2, 5.0)
+
+
+def _eval_case(
+    case_dir: Path, build_tasks: dict[str, str] | None
+) -> tuple[dict | None, float | None, float | None]:
+    """Evalúa un caso y regresa (resultado, latencia_fetch_ms, latencia_build_sec).
+
+    build_tasks es el mapa case_id -> task_id que produjo el POST batch de
+    builds (None cuando no se pidió --build-before-eval).
+    """
+    expected_file = case_dir / "expected_fields.json"
+    if not expected_file.exists():
+        return None, None, None
+    expected = load_expected(expected_file)
+    case_id = expected.get("case_id")
+    if not case_id:
+        return {"case": case_dir.name, "error": "missing_case_id"}, None, None
+
+    build_latency: float | None = None
+    if build_tasks is not None:
+        task_id = build_tasks.get(case_id)
+        if task_id is None:
+            return {"case": case_dir.name, "error": "build_enqueue_failed"}, None, None
+        status, build_latency = wait_task(task_id)
+        if status != "SUCCESS":
+            return (
+                {"case": case_dir.name, "error": f"build_{status.lower()}"},
+                None,
+                build_latency,
+            )
+
+    expected_mtime_ns = expected_file.stat().st_mtime_ns
+    cached = _SHEET_CACHE.get(case_id)
+    prev_etag = None
+    if cached and cached.get("expected_mtime_ns") == expected_mtime_ns:
+        prev_etag = cached.get("etag")
+
+    sheet, latency_ms, etag = fetch_sheet(case_id, etag=prev_etag)
+    if sheet is None:
+        if prev_etag is not None and etag == prev_etag:
+            # 304: ni la ficha ni el expected cambiaron; reusa las stats.
+            stats = dict(cached["stats"])
+            stats["case"] = case_dir.name
+            return stats, latency_ms, build_latency
+        return {"case": case_dir.name, "error": "sheet_unavailable"}, latency_ms, build_latency
+
+    stats = compare_case(expected, sheet)
+    if etag:
+        with _sheet_cache_lock:
+            _SHEET_CACHE[case_id] = {
+                "etag": etag,
+                "expected_mtime_ns": expected_mtime_ns,
+                "stats": dict(stats),
+            }
+    stats["case"] = case_dir.name
+    return stats, latency_ms, build_latency
 
 
 def main() -> None:
@@ -141,45 +193,52 @@ def main() -> None:
     started_eval = time.perf_counter()
 
     with mlflow.start_run(run_name=args.run_name):
-        mlflow.log_param("provider", args.provider)
-        mlflow.log_param("model_name", args.model_name)
-        mlflow.log_param("dataset_root", str(dataset_root))
-        mlflow.log_param("build_before_eval", bool(args.build_before_eval))
-
-        for case_dir in sorted(dataset_root.glob("case_*")):
-            expected_file = case_dir / "expected_fields.json"
-            if not expected_file.exists():
-                continue
-            expected = json.loads(expected_file.read_text(encoding="utf-8"))
-            case_id = expected.get("case_id")
-            if not case_id:
-                case_results.append({"case": case_dir.name, "error": "missing_case_id"})
-                continue
-
-            if args.build_before_eval:
-                task_id = trigger_build(case_id)
-                if task_id is None:
-                    case_results.append({"case": case_dir.name, "error": "build_enqueue_failed"})
-                    continue
-                status, build_latency = wait_task(task_id)
-                build_latencies_sec.append(build_latency)
-                if status != "SUCCESS":
-                    case_results.append({"case": case_dir.name, "error": f"build_{status.lower()}"})
+        # Un solo RPC al tracking server en vez de uno por parámetro.
+        mlflow.log_params(
+            {
+                "provider": args.provider,
+                "model_name": args.model_name,
+                "dataset_root": str(dataset_root),
+                "build_before_eval": bool(args.build_before_eval),
+            }
+        )
+
+        # El trabajo es 100% I/O (esperar al backend), así que un pool de hilos
+        # solapa los requests; map preserva el orden de los casos y las
+        # latencias se miden por-request dentro de cada worker.
+        case_dirs = sorted(dataset_root.glob("case_*"))
+
+        # Con --build-before-eval todos los builds se encolan en un solo POST
+        # batch; los workers solo esperan su tarea (load_expected está
+        # memoizado, así que releer el case_id aquí es gratis).
+        build_tasks: dict[str, str] | None = None
+        if args.build_before_eval:
+            case_ids = []
+            for case_dir in case_dirs:
+                expected_file = case_dir / "expected_fields.json"
+                if expected_file.exists():
+                    case_id = load_expected(expected_file).get("case_id")
+                    if case_id:
+                        case_ids.append(case_id)
+            build_tasks = trigger_build_many(case_ids)
+
+        _SHEET_CACHE.update(_load_sheet_cache())
+        worker = partial(_eval_case, build_tasks=build_tasks)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            for result, latency_ms, build_latency in pool.map(worker, case_dirs):
+                if result is None:
                     continue
-
-            sheet, latency_ms = fetch_sheet(case_id)
-            latencies_ms.append(latency_ms)
-            if sheet is None:
-                case_results.append({"case": case_dir.name, "error": "sheet_unavailable"})
-                continue
-            stats = compare_case(expected, sheet)
-            stats["case"] = case_dir.name
-            case_results.append(stats)
+                if latency_ms is not None:
+                    latencies_ms.append(latency_ms)
+                if build_latency is not None:
+                    build_latencies_sec.append(build_latency)
+                case_results.append(result)
+        _save_sheet_cache()
 
         valid_results = [r for r in case_results if "error" not in r]
         if not valid_results:
             mlflow.log_param("result", "no_valid_cases")
-            print(json.dumps({"results": case_results, "summary": {"error": "no_valid_cases"}}, indent=2, ensure_ascii=False))
+            print(json_dumps({"results": case_results, "summary": {"error": "no_valid_cases"}}))
             return
 
         summary = summarize(valid_results)
@@ -188,28 +247,34 @@ def main() -> None:
         avg_build_latency_sec = (sum(build_latencies_sec) / len(build_latencies_sec)) if build_latencies_sec else 0.0
         tokens_per_second = (args.token_count / eval_time_sec) if args.token_count > 0 else 0.0
 
-        mlflow.log_metric("accuracy_pct", summary["accuracy_pct"])
-        mlflow.log_metric("coverage_pct", summary["coverage_pct"])
-        mlflow.log_metric("critical_coverage_pct", summary["critical_coverage_pct"])
-        mlflow.log_metric("invented_facts", summary["invented_facts"])
-        mlflow.log_metric("avg_api_latency_ms", round(avg_latency_ms, 4))
-        mlflow.log_metric("avg_build_latency_sec", round(avg_build_latency_sec, 4))
-        mlflow.log_metric("eval_total_time_sec", round(eval_time_sec, 4))
-        mlflow.log_metric("tokens_per_second", round(tokens_per_second, 4))
-
-        mlflow.log_text(json.dumps(case_results, ensure_ascii=False, indent=2), "case_results.json")
-
-        output = {
-            "results": case_results,
-            "summary": {
-                **summary,
-                "avg_api_latency_ms": round(avg_latency_ms, 2),
-                "avg_build_latency_sec": round(avg_build_latency_sec, 2),
-                "eval_total_time_sec": round(eval_time_sec, 2),
+        # log_metrics manda las ocho métricas en un solo RPC en vez de ocho.
+        mlflow.log_metrics(
+            {
+                "accuracy_pct": summary["accuracy_pct"],
+                "coverage_pct": summary["coverage_pct"],
+                "critical_coverage_pct": summary["critical_coverage_pct"],
+                "invented_facts": summary["invented_facts"],
+                "avg_api_latency_ms": round(avg_latency_ms, 4),
+                "avg_build_latency_sec": round(avg_build_latency_sec, 4),
+                "eval_total_time_sec": round(eval_time_sec, 4),
                 "tokens_per_second": round(tokens_per_second, 4),
-            },
+            }
+        )
+
+        # case_results se serializa una sola vez: la misma cadena alimenta el
+        # artefacto de MLflow y el JSON final en stdout.
+        case_results_json = json_dumps(case_results)
+        mlflow.log_text(case_results_json, "case_results.json")
+
+        summary_payload = {
+            **summary,
+            "avg_api_latency_ms": round(avg_latency_ms, 2),
+            "avg_build_latency_sec": round(avg_build_latency_sec, 2),
+            "eval_total_time_sec": round(eval_time_sec, 2),
+            "tokens_per_second": round(tokens_per_second, 4),
         }
-        print(json.dumps(output, indent=2, ensure_ascii=False))
+        summary_json = json_dumps(summary_payload)
+        print('{"results": %s, "summary": %s}' % (case_results_json, summary_json))
 
 
 if __name__ == "__main__":